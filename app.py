@@ -154,7 +154,7 @@ if selection == "🏠 Overview":
         <ul class='tool-list'>
             <li><b>📐 Standardiser:</b> Effortlessly clean and align your Excel and PBI sheets for consistency.</li>
             <li><b>📊 Validation Report:</b> Quickly compare data sheets and identify key performance indicator differences.</li>
-            <li><b>🧩 File Merger:</b> Seamlessly combine up to 10 Excel files into a single, unified document.</li>
+            <li><b>🧩 File Merger:</b> Seamlessly combine any number of validation reports into a single, unified document.</li>
         </ul>
     """, unsafe_allow_html=True)
 
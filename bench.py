@@ -0,0 +1,170 @@
+# bench.py
+"""
+Benchmark harness for the toolkit.
+
+    python bench.py --rows 10000 100000 --dims 3 --cardinality 50 --measures 2 --mismatch-rate 0.05
+
+For each row count a synthetic workbook with 'excel' and 'PBI' sheets is generated and every
+stage of the pipeline is timed separately: parse, standardize_column_data, normalisation,
+aggregate_side for both sheets, key matching (build_validation_report), the column checklist and
+diff checker, the report xlsx write and combine_excel_files over copies of that report. Wall time, rows processed, the resident memory at
+the start and end of each stage and the process peak RSS are written to a JSON file
+(bench_results.json by default) so runs of different versions can be compared. --trace-memory also records the tracemalloc peak of each
+stage, at the cost of much slower timings.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from headless import NamedBytesIO, quiet_streamlit_logging
+
+quiet_streamlit_logging()
+import std  # noqa: E402  The page modules create their st.cache_data caches at import time
+import val  # noqa: E402
+import mrg  # noqa: E402
+import readers  # noqa: E402
+from instrument import StageRecorder  # noqa: E402
+
+
+def generate_workbook(rows, dims=3, cardinality=50, measures=2, mismatch_rate=0.05, one_sided_rate=0.02, seed=0):
+    """
+    Returns the bytes of a workbook with 'excel' and 'PBI' sheets of `rows` rows each.
+    Dimension i is text with `cardinality` distinct values; the measures of a `mismatch_rate`
+    share of PBI rows are perturbed, and a `one_sided_rate` share of rows gets a dimension value
+    that only exists on one side.
+    """
+    rng = np.random.default_rng(seed)
+    dim_names = [f"Dim{i + 1}" for i in range(dims)]
+    measure_names = [f"Measure{i + 1}" for i in range(measures)]
+
+    excel = pd.DataFrame({name: pd.Series(rng.integers(0, cardinality, rows)).map(lambda v, n=name: f"{n}_V{v}") for name in dim_names})
+    for name in measure_names:
+        excel[name] = np.round(rng.uniform(1, 1000, rows), 2)
+
+    pbi = excel.copy()
+    mismatched = rng.random(rows) < mismatch_rate
+    for name in measure_names:
+        pbi.loc[mismatched, name] = np.round(pbi.loc[mismatched, name] * rng.uniform(0.5, 1.5, mismatched.sum()), 2)
+    if dims:
+        excel.loc[rng.random(rows) < one_sided_rate, dim_names[0]] = "EXCEL_ONLY"
+        pbi.loc[rng.random(rows) < one_sided_rate, dim_names[0]] = "PBI_ONLY"
+    pbi = pbi.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    wb = Workbook(write_only=True)
+    for sheet_name, df in (("excel", excel), ("PBI", pbi)):
+        ws = wb.create_sheet(sheet_name)
+        ws.append(list(df.columns))
+        for row in df.itertuples(index=False):
+            ws.append(list(row))
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def run_benchmark(rows, args):
+    print(f"rows={rows}", file=sys.stderr)
+    recorder = StageRecorder("bench", args.trace_memory)
+    started = time.perf_counter()
+    workbook_bytes = generate_workbook(rows, args.dims, args.cardinality, args.measures, args.mismatch_rate, args.one_sided_rate, args.seed)
+    generate_seconds = round(time.perf_counter() - started, 3)
+
+    with recorder.stage("parse", 2 * rows):
+        excel_df = readers.read_sheet(workbook_bytes, "excel", args.reader_backend)
+        pbi_df = readers.read_sheet(workbook_bytes, "PBI", args.reader_backend)
+
+    common_columns = [col for col in excel_df.columns if col in pbi_df.columns]
+    with recorder.stage("standardize", 2 * rows):
+        excel_df, pbi_df = std.standardize_column_data(excel_df, pbi_df, common_columns)
+
+    with recorder.stage("normalise", 2 * rows):
+        excel_df = val.normalise_text_columns(excel_df)
+        pbi_df = val.normalise_text_columns(pbi_df)
+
+    with recorder.stage("aggregate", 2 * rows):
+        dims, all_measures = val.detect_dims_and_measures(excel_df, pbi_df)
+        excel_agg, excel_totals = val.aggregate_side(excel_df, dims, all_measures)
+        pbi_agg, pbi_totals = val.aggregate_side(pbi_df, dims, all_measures)
+
+    with recorder.stage("key_matching", len(excel_agg) + len(pbi_agg)):
+        validation_report, _, _ = val.build_validation_report(excel_agg, pbi_agg, dims, all_measures, excel_totals, pbi_totals, key_mode=args.key_mode)
+
+    with recorder.stage("checklist_and_diff", len(validation_report)):
+        column_checklist_df = val.column_checklist(excel_df, pbi_df)
+        diff_checker_df = val.generate_diff_checker(validation_report)
+
+    writer = val.write_report_workbook_streaming if args.streaming_writer else val.write_report_workbook
+    with recorder.stage("report_write", len(validation_report)):
+        report_bytes = writer(validation_report, column_checklist_df, diff_checker_df, "bench_validation_report", 0.05, 0.5).getvalue()
+
+    merge_files = [NamedBytesIO(report_bytes, f"bench_{i}_validation_report.xlsx") for i in range(args.merge_files)]
+    with recorder.stage("merge", len(validation_report) * args.merge_files):
+        mrg.combine_excel_files(merge_files, 0.05, 0.5)
+
+    for entry in recorder.stages:
+        print(f"  {entry['stage']:<18} {entry['seconds']:>9.3f}s", file=sys.stderr)
+    return {
+        "rows": rows,
+        "workbook_mb": round(len(workbook_bytes) / (1024 * 1024), 2),
+        "report_rows": len(validation_report) - 1,
+        "generate_seconds": generate_seconds,
+        "total_seconds": recorder.total_seconds(),
+        "stages": recorder.stages,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Time each stage of the toolkit on synthetic workbooks.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="Rows per sheet; one benchmark per value.")
+    parser.add_argument("--dims", type=int, default=3, help="Text dimension columns.")
+    parser.add_argument("--cardinality", type=int, default=50, help="Distinct values per dimension.")
+    parser.add_argument("--measures", type=int, default=2, help="Numeric measure columns.")
+    parser.add_argument("--mismatch-rate", type=float, default=0.05, help="Share of PBI rows with perturbed measures.")
+    parser.add_argument("--one-sided-rate", type=float, default=0.02, help="Share of rows whose key exists on one side only.")
+    parser.add_argument("--merge-files", type=int, default=4, help="Copies of the report passed to combine_excel_files.")
+    parser.add_argument("--key-mode", choices=["string", "codes"], default="string")
+    parser.add_argument("--streaming-writer", action="store_true", help="Time the write-only report writer.")
+    parser.add_argument("--reader-backend", default=None, help="readers.py backend for the parse stage (default: auto).")
+    parser.add_argument("--trace-memory", action="store_true", help="Also record the tracemalloc peak of each stage (slow).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "reader_backend": readers.resolve_backend(args.reader_backend),
+        "config": {key: value for key, value in vars(args).items() if key not in ("rows", "output")},
+        "runs": [run_benchmark(rows, args) for rows in args.rows],
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# cache.py
+import hashlib
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from readers import read_sheet, resolve_backend
+
+# Parsed sheets are stored as Parquet files named by a hash of the uploaded bytes and sheet name,
+# so the same workbook is parsed by openpyxl once per server instead of on every Streamlit rerun.
+CACHE_DIR = os.environ.get("VALIDATOR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "validator_sheet_cache"))
+CACHE_MAX_BYTES = int(os.environ.get("VALIDATOR_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+CACHE_FORMAT_VERSION = "1"
+
+
+def workbook_digest(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def sheet_cache_path(digest, sheet_name, cache_dir=None, backend="openpyxl"):
+    # Backends can parse the same cells into different dtypes, so each gets its own entry
+    sheet_hash = hashlib.sha256(f"{CACHE_FORMAT_VERSION}:{backend}:{sheet_name}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir or CACHE_DIR, f"{digest}-{sheet_hash}.parquet")
+
+
+def evict_lru(cache_dir=None, max_bytes=None):
+    """Removes the least recently used cache files until the cache fits in max_bytes."""
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith(".parquet"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= size
+        except OSError:
+            pass  # Already removed by another session
+
+
+def restore_missing_text(df):
+    """Parquet returns the missing cells of object columns as None; read_excel gives NaN."""
+    for idx in range(df.shape[1]):
+        column = df.iloc[:, idx]
+        if column.dtype == object and column.isna().any():
+            df.isetitem(idx, column.where(column.notna(), np.nan))
+    return df
+
+
+def read_excel_cached(file_bytes, sheet_name, cache_dir=None, max_bytes=None, backend=None):
+    """
+    Returns pd.read_excel(file_bytes, sheet_name) parsed by the selected reader backend (see readers.py),
+    served from the on-disk Parquet cache when the same bytes and sheet were parsed before.
+    Raises ValueError if the sheet does not exist.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    backend = resolve_backend(backend)
+    path = sheet_cache_path(workbook_digest(file_bytes), sheet_name, cache_dir, backend)
+
+    if max_bytes > 0 and os.path.exists(path):
+        try:
+            df = restore_missing_text(pd.read_parquet(path))
+            os.utime(path)  # Mark as recently used for LRU eviction
+            return df
+        except Exception:
+            pass  # Unreadable entry (e.g. partially evicted); parse again below
+
+    df = read_sheet(file_bytes, sheet_name, backend)
+
+    if max_bytes > 0:
+        tmp_path = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # A unique temp file per write: Streamlit sessions are threads of one process
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=cache_dir)
+            os.close(fd)
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+            evict_lru(cache_dir, max_bytes)
+        except Exception:
+            # Sheets Arrow cannot represent (mixed-type object columns, non-string headers)
+            # are simply not cached
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return df
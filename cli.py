@@ -0,0 +1,244 @@
+# cli.py
+"""
+Headless entry point for the toolkit, for unattended (e.g. nightly) runs on a server.
+
+    python cli.py standardize INPUT_DIR OUTPUT_DIR [--workers N]
+    python cli.py validate INPUT_DIR OUTPUT_DIR [--workers N] [--compare-workers N] [--standardize] [--merge] ...
+    python cli.py merge INPUT_DIR OUTPUT_DIR [--workers N] [--streaming] ...
+
+Every *.xlsx workbook in INPUT_DIR is processed by a pool of worker processes, outputs are written
+to OUTPUT_DIR with the same names the Streamlit pages use, and a run_summary.json describing each
+file (status, error, timings and, for validation, the report metadata) is written alongside them.
+The exit code is 1 if any file failed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from headless import NamedBytesIO, quiet_streamlit_logging
+
+RUN_SUMMARY_FILENAME = "run_summary.json"
+
+# Called before the page modules are imported: they create their st.cache_data caches at import time
+quiet_streamlit_logging()
+import std  # noqa: E402
+import val  # noqa: E402
+import mrg  # noqa: E402
+from instrument import StageRecorder, stage  # noqa: E402
+
+
+def list_workbooks(input_dir):
+    # "~$" files are Excel lock files, not workbooks
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(".xlsx") and not name.startswith("~$")
+    )
+
+
+def standardize_file(path, output_dir, column_workers=1, compact_dtypes=False, timings=False):
+    original_name = os.path.splitext(os.path.basename(path))[0]
+    recorder = StageRecorder("std") if timings else None
+    with open(path, "rb") as f:
+        output, common_columns = std.standardize_workbook(f.read(), column_workers, compact_dtypes, recorder)
+    if output is None:
+        raise ValueError("No common columns found between 'excel' and 'PBI' sheets.")
+    output_path = os.path.join(output_dir, f"{original_name}_standardized.xlsx")
+    with open(output_path, "wb") as f:
+        f.write(output.getvalue())
+    result = {"output": output_path, "common_columns": [str(col) for col in common_columns]}
+    if recorder is not None:
+        result["stages"] = recorder.stages
+    return result
+
+
+def validate_file(path, output_dir, options):
+    original_filename = os.path.splitext(os.path.basename(path))[0]
+    recorder = StageRecorder("val") if options["timings"] else None
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    if options["standardize"]:
+        standardized, _ = std.standardize_workbook(file_bytes, options["column_workers"], options["compact_dtypes"], recorder)
+        if standardized is None:
+            raise ValueError("No common columns found between 'excel' and 'PBI' sheets.")
+        file_bytes = standardized.getvalue()
+
+    validation_report, column_checklist_df, diff_checker_df, top_mismatches_df = val.compute_validation(
+        file_bytes, options["key_mode"], options["streaming"], options["compact_dtypes"], recorder, options["compare_workers"])
+    with stage(recorder, "report_write", len(validation_report)):
+        output, metadata = val.build_report_workbook(validation_report, column_checklist_df, diff_checker_df, original_filename,
+                                           options["low"], options["mid"], options["streaming_writer"], options["native_rules"], top_mismatches_df,
+                                           options["exceptions_only"])
+
+    output_path = os.path.join(output_dir, f"{original_filename}_validation_report.xlsx")
+    with open(output_path, "wb") as f:
+        f.write(output)
+    result = {"output": output_path, "metadata": metadata}
+    if recorder is not None:
+        result["stages"] = recorder.stages
+    return result
+
+
+def run_file_task(task, path, *args):
+    """Runs one file in a worker; failures are recorded in the result instead of aborting the run."""
+    quiet_streamlit_logging()
+    started = time.perf_counter()
+    result = {"file": os.path.basename(path), "status": "ok", "error": None}
+    try:
+        result.update(task(path, *args))
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_pool(task, paths, workers, *args):
+    """Results in input order. workers <= 1 runs in-process."""
+    results = []
+    if workers <= 1:
+        for done, path in enumerate(paths, 1):
+            results.append(run_file_task(task, path, *args))
+            report_progress(done, len(paths), results[-1])
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_file_task, task, path, *args) for path in paths]
+        for done, future in enumerate(futures, 1):
+            results.append(future.result())
+            report_progress(done, len(paths), results[-1])
+    return results
+
+
+def report_progress(done, total, result):
+    status = "ok" if result["status"] == "ok" else f"FAILED ({result['error']})"
+    print(f"[{done}/{total}] {result['file']}: {status} in {result['seconds']}s", file=sys.stderr)
+
+
+def merge_reports(paths, output_dir, options):
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append(NamedBytesIO(f.read(), os.path.basename(path)))
+
+    def progress(done, total, file_name):
+        print(f"[merge {done}/{total}] {file_name}", file=sys.stderr)
+
+    recorder = StageRecorder("mrg") if options["timings"] else None
+    output, output_filename, file_errors = mrg.combine_excel_files(
+        files, options["low"], options["mid"], options["native_rules"],
+        True if options["merge_streaming"] else None, options["workers"], progress_callback=progress, recorder=recorder)
+    for file_name, error in file_errors.items():
+        print(f"[merge] {file_name}: FAILED ({error})", file=sys.stderr)
+    if output is None:
+        return None, None, file_errors
+    output_path = os.path.join(output_dir, output_filename)
+    with open(output_path, "wb") as f:
+        f.write(output.getvalue())
+    return output_path, recorder.stages if recorder is not None else None, file_errors
+
+
+def write_run_summary(output_dir, summary):
+    path = os.path.join(output_dir, RUN_SUMMARY_FILENAME)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, default=str)
+    return path
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless Data Validation Toolkit.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(sub):
+        sub.add_argument("input_dir", help="Directory of .xlsx workbooks to process.")
+        sub.add_argument("output_dir", help="Directory for the outputs and run_summary.json (created if missing).")
+        sub.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count).")
+        sub.add_argument("--timings", action="store_true", help="Record per-stage timings and memory in run_summary.json.")
+
+    def add_thresholds(sub):
+        sub.add_argument("--low", type=float, default=0.05, help="Green threshold (default 0.05).")
+        sub.add_argument("--mid", type=float, default=0.5, help="Amber threshold (default 0.5).")
+        sub.add_argument("--native-rules", action="store_true", help="Emit native Excel conditional-formatting rules.")
+
+    def add_column_workers(sub):
+        sub.add_argument("--column-workers", type=int, default=1, help="Processes per workbook for column standardisation (default 1).")
+        sub.add_argument("--compact-dtypes", action="store_true", help="Use categorical text and datetime64 dates.")
+
+    standardize = subparsers.add_parser("standardize", help="Standardize the 'excel' and 'PBI' sheets of each workbook.")
+    add_common(standardize)
+    add_column_workers(standardize)
+
+    validate = subparsers.add_parser("validate", help="Write a validation report for each workbook.")
+    add_common(validate)
+    add_thresholds(validate)
+    validate.add_argument("--standardize", action="store_true", help="Standardize each workbook before validating it.")
+    add_column_workers(validate)
+    validate.add_argument("--key-mode", choices=["string", "codes"], default="string", help="How report rows are keyed.")
+    validate.add_argument("--compare-workers", type=int, default=1, help="Processes per workbook for hash-partitioned aggregation and matching (default 1).")
+    validate.add_argument("--streaming", action="store_true", help="Aggregate the input sheets chunk by chunk.")
+    validate.add_argument("--streaming-writer", action="store_true", help="Write reports with the write-only writer.")
+    validate.add_argument("--exceptions-only", action="store_true", help="Write only one-sided keys and keys above the amber threshold.")
+    validate.add_argument("--merge", action="store_true", help="Merge the successful reports into one workbook.")
+    validate.add_argument("--merge-streaming", action="store_true", help="Force the bounded-memory merge.")
+
+    merge = subparsers.add_parser("merge", help="Merge all validation reports in the directory into one workbook.")
+    add_common(merge)
+    add_thresholds(merge)
+    merge.add_argument("--merge-streaming", "--streaming", dest="merge_streaming", action="store_true", help="Force the bounded-memory merge.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    quiet_streamlit_logging()
+    if not os.path.isdir(args.input_dir):
+        print(f"Input directory not found: {args.input_dir}", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    options = {key: value for key, value in vars(args).items() if key not in ("command", "input_dir", "output_dir")}
+    paths = list_workbooks(args.input_dir)
+    started_at = datetime.now()
+    started = time.perf_counter()
+    results = []
+    merged_output = merge_stages = None
+
+    if args.command == "standardize":
+        results = run_pool(standardize_file, paths, args.workers, args.output_dir, args.column_workers, args.compact_dtypes, args.timings)
+    elif args.command == "validate":
+        results = run_pool(validate_file, paths, args.workers, args.output_dir, options)
+        if args.merge:
+            merged_output, merge_stages, merge_errors = merge_reports([r["output"] for r in results if r["status"] == "ok"], args.output_dir, options)
+            # A report that was written but could not be read back is missing from the merge
+            for result in results:
+                if result["status"] == "ok" and os.path.basename(result["output"]) in merge_errors:
+                    result.update(status="error", error=f"merge: {merge_errors[os.path.basename(result['output'])]}")
+    elif args.command == "merge":
+        merged_output, merge_stages, merge_errors = merge_reports(paths, args.output_dir, options)
+        results = [{"file": os.path.basename(path), "status": "error" if os.path.basename(path) in merge_errors else "ok",
+                    "error": merge_errors.get(os.path.basename(path))} for path in paths]
+
+    failed = sum(1 for r in results if r["status"] != "ok")
+    summary = {
+        "command": args.command,
+        "input_dir": os.path.abspath(args.input_dir),
+        "output_dir": os.path.abspath(args.output_dir),
+        "options": options,
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "seconds": round(time.perf_counter() - started, 3),
+        "files_total": len(paths),
+        "files_succeeded": len(results) - failed,
+        "files_failed": failed,
+        "merged_output": merged_output,
+        "merge_stages": merge_stages,
+        "files": results,
+    }
+    summary_path = write_run_summary(args.output_dir, summary)
+    print(f"Run summary written to {summary_path}", file=sys.stderr)
+    return 1 if failed or (args.command == "merge" and merged_output is None) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+# headless.py
+# Helpers for running the page modules outside `streamlit run` (cli.py, bench.py and the tests).
+import io
+import logging
+
+
+class NamedBytesIO(io.BytesIO):
+    """In-memory stand-in for a Streamlit UploadedFile: the bytes plus a .name."""
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def quiet_streamlit_logging():
+    """
+    Raises the streamlit loggers to ERROR: Streamlit warns about a missing ScriptRunContext for
+    every st.* call made outside `streamlit run`. Call it before importing std, val or mrg, which
+    create their st.cache_data caches at import time.
+    """
+    import streamlit  # noqa: F401  Imported here so its loggers exist before they are silenced
+
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
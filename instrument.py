@@ -0,0 +1,115 @@
+# instrument.py
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    High-water mark of the process resident memory since it started, or None where it cannot be read.
+    In a long-running Streamlit server this is the peak of every run so far, not of one stage.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb():
+    """Resident memory of the process right now (Linux only), or None where it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
+class StageRecorder:
+    """
+    Opt-in per-stage instrumentation. Each `with recorder.stage(name, rows):` block appends
+    {'stage', 'seconds', 'rows', 'rss_start_mb', 'rss_end_mb', 'process_peak_rss_mb'} to
+    recorder.stages. rss_start_mb / rss_end_mb are the resident memory around the block (Linux);
+    process_peak_rss_mb is the lifetime peak of the process, so it only rises and does not belong
+    to the stage. With trace_memory the tracemalloc peak of the block itself is added as
+    'traced_peak_mb' (slower). rows can also be set on the yielded entry once the stage knows
+    how many it processed. Stages are not nested.
+    """
+    def __init__(self, tool, trace_memory=False, context=None):
+        self.tool = tool
+        self.trace_memory = trace_memory
+        self.context = context or {}
+        self.started_at = datetime.now()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        entry = {"stage": name, "seconds": None, "rows": rows, "rss_start_mb": current_rss_mb(), "rss_end_mb": None, "process_peak_rss_mb": None}
+        owns_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if owns_tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["seconds"] = round(time.perf_counter() - started, 4)
+            entry["rss_end_mb"] = current_rss_mb()
+            entry["process_peak_rss_mb"] = peak_rss_mb()
+            if self.trace_memory:
+                entry["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            if owns_tracing:
+                tracemalloc.stop()
+            self.stages.append(entry)
+
+    def total_seconds(self):
+        return round(sum(entry["seconds"] for entry in self.stages), 4)
+
+    def to_dict(self):
+        return {
+            "tool": self.tool,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "total_seconds": self.total_seconds(),
+            "trace_memory": self.trace_memory,
+            "context": self.context,
+            "stages": self.stages,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, default=str)
+
+
+def stage(recorder, name, rows=None):
+    """recorder.stage(name, rows), or a no-op block yielding a throwaway entry when recorder is None."""
+    if recorder is None:
+        return nullcontext({})
+    return recorder.stage(name, rows)
+
+
+def instrumentation_options(key_prefix):
+    """Sidebar checkboxes shared by the pages; returns (record_stages, trace_memory)."""
+    record_stages = st.sidebar.checkbox("Record stage timings", value=False, key=f"{key_prefix}_record_stages_sidebar", help="Time each stage (reading, aggregating, writing, ...) and show the results below the output. Cached results, parsed sheets and aggregates are bypassed while this is on, so every stage runs.")
+    trace_memory = st.sidebar.checkbox("Trace memory per stage", value=False, key=f"{key_prefix}_trace_memory_sidebar", disabled=not record_stages, help="Also record the peak Python memory of each stage with tracemalloc. Makes the run noticeably slower.")
+    return record_stages, record_stages and trace_memory
+
+
+def show_stage_timings(recorder, file_stem):
+    """Collapsible panel with the stage table and a JSON download."""
+    if recorder is None or not recorder.stages:
+        return
+    with st.expander(f"⏱️ Stage timings ({recorder.total_seconds():.2f}s total)", expanded=False):
+        st.dataframe(pd.DataFrame(recorder.stages), hide_index=True)
+        st.download_button("Download timings (JSON)", recorder.to_json(), f"{file_stem}_{recorder.tool}_timings.json", "application/json", key=f"{recorder.tool}_timings_download")
@@ -2,258 +2,430 @@
 import streamlit as st
 import pandas as pd
 import io
+import itertools
 import os
-from openpyxl import Workbook, load_workbook
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Font
-from openpyxl.utils import get_column_letter
 import base64  # For base64 image encoding
+from readers import open_workbook
+from instrument import StageRecorder, instrumentation_options, show_stage_timings, stage
+from val import REPORT_METADATA_SHEET, TOP_MISMATCH_SHEET, add_diff_threshold_rules, add_native_conditional_formatting, parse_report_metadata
 
 # Check for openpyxl availability
 try:
-    from openpyxl import Workbook, load_workbook
+    from openpyxl import Workbook
 except ImportError:
     st.error(
         "The 'openpyxl' library is not installed. Please ensure it's included in your requirements.txt and the environment is set up correctly.")
     st.stop()
 
 
-def apply_main_sheet_conditional_formatting(ws, sheet_name_in_wb, workbook_obj, low_thresh, mid_thresh):
-    temp_buffer_for_df = io.BytesIO()
-    workbook_obj.save(temp_buffer_for_df) # Save current state of workbook to read from
-    temp_buffer_for_df.seek(0)
-    try:
-        df = pd.read_excel(temp_buffer_for_df, sheet_name=sheet_name_in_wb)
-        if df.empty: 
-            return
-    except ValueError as e:
-        st.warning(f"Could not read sheet '{sheet_name_in_wb}' for formatting. Skipping. Error: {e}")
-        return
+def amber_gradient_fill(value, low_thresh, mid_thresh):
+    # Yellow at the green threshold fading to dark red at the amber threshold
+    if mid_thresh > low_thresh:
+        ratio = (value - low_thresh) / (mid_thresh - low_thresh)
+        r_comp = max(0, min(int(255 + (139 - 255) * ratio), 255))
+        g_comp = max(0, min(int(255 - (255 - 0) * ratio), 255))
+        b_comp = 0
+        color_hex = f'{r_comp:02X}{g_comp:02X}{b_comp:02X}'
+        return PatternFill(start_color=color_hex, end_color=color_hex, fill_type='solid')
+    return PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
+
+
+# Merges of more files than this always use the bounded-memory streaming mode
+STREAMING_MERGE_MIN_FILES = 10
+
+
+def apply_main_sheet_conditional_formatting(ws, low_thresh, mid_thresh, native_rules=False):
+    """
+    Formats a copied report sheet from the cell values already in ws (no save / re-read of the workbook).
+    native_rules=True writes the colouring as worksheet-level conditional-formatting rules instead of per-cell fills.
+    """
+    if ws.max_row < 2:
+        return # Header only (or empty): nothing to format
+
+    dark_green_fill_main = PatternFill(start_color='19D119', end_color='19D119', fill_type='solid')
+    dark_red_fill_main = PatternFill(start_color='E82D1C', end_color='E82D1C', fill_type='solid')
 
+    header = [cell.value for cell in ws[1]]
+    diff_col_idxs = [idx for idx, col_name in enumerate(header) if isinstance(col_name, str) and col_name.endswith('_Diff')]
+    presence_col_idx = header.index('presence') if 'presence' in header else None
+
+    for row in ws.iter_rows(min_row=2):
+        for col_idx in diff_col_idxs:
+            cell = row[col_idx]
+            value = cell.value
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and pd.notna(value):
+                cell.number_format = '0.00%'
+                if native_rules: continue
+                if value <= low_thresh: cell.fill = dark_green_fill_main
+                elif value <= mid_thresh: cell.fill = amber_gradient_fill(value, low_thresh, mid_thresh)
+                else: cell.fill = dark_red_fill_main
+
+        if presence_col_idx is not None and not native_rules:
+            value = row[presence_col_idx].value
+            if str(value) == 'Present in Both': row[presence_col_idx].fill = dark_green_fill_main
+            elif str(value) in ['Present in excel', 'Present in PBI']: row[presence_col_idx].fill = dark_red_fill_main
+
+    if native_rules:
+        # Row 2 is the summary row; its own fill below must not be overridden by the rules
+        add_native_conditional_formatting(ws, header, 3, ws.max_row, low_thresh, mid_thresh, amber_gradient=True)
+
+    summary_row_blue = '80BBD9'
+    summary_fill = PatternFill(start_color=summary_row_blue, end_color=summary_row_blue, fill_type='solid')
+    header_row_darker_blue = '609AB9'
+    header_fill = PatternFill(start_color=header_row_darker_blue, end_color=header_row_darker_blue, fill_type='solid')
+    bold_font = Font(bold=True)
+
+    for col_excel_idx in range(1, ws.max_column + 1): 
+        ws.cell(row=1, column=col_excel_idx).font = bold_font
+        ws.cell(row=1, column=col_excel_idx).fill = header_fill
+
+    for col_excel_idx in range(1, ws.max_column + 1):
+        ws.cell(row=2, column=col_excel_idx).font = bold_font
+        ws.cell(row=2, column=col_excel_idx).fill = summary_fill
+
+
+def stream_report_rows(rows, ws_target, low_thresh, mid_thresh, native_rules=False):
+    """
+    Copies the value rows of a report sheet into a write-only sheet, formatting each row as it is
+    written (same result as apply_main_sheet_conditional_formatting). Only one row is held at a time.
+    Returns the summary row's A2 value and presence value for All_Pages_Summary.
+    """
     dark_green_fill_main = PatternFill(start_color='19D119', end_color='19D119', fill_type='solid')
     dark_red_fill_main = PatternFill(start_color='E82D1C', end_color='E82D1C', fill_type='solid')
-    
-    presence_col_name = 'presence'
-    presence_col_df_idx = df.columns.get_loc(presence_col_name) if presence_col_name in df.columns else None
-
-    for df_col_idx, df_col_name in enumerate(df.columns):
-        excel_col_letter = get_column_letter(df_col_idx + 1)
-        for excel_row_num in range(2, len(df) + 2): 
-            df_row_idx = excel_row_num - 2
-            cell = ws[f'{excel_col_letter}{excel_row_num}']
-            # Ensure value is read from DataFrame, as cell.value might be None if sheet was just created
-            if df_row_idx < len(df) and df_col_idx < len(df.columns):
-                 value = df.iat[df_row_idx, df_col_idx]
-            else:
-                continue # Should not happen if df is read correctly
-
-            if df_col_name.endswith('_Diff'):
-                if pd.notna(value) and isinstance(value, (int, float)):
-                    cell.value = value 
-                    cell.number_format = '0.00%'
-                    if value <= low_thresh: cell.fill = dark_green_fill_main
-                    elif value <= mid_thresh:
-                        if mid_thresh > low_thresh:
-                            ratio = (value - low_thresh) / (mid_thresh - low_thresh)
-                            r_comp = max(0, min(int(255 + (139 - 255) * ratio), 255))
-                            g_comp = max(0, min(int(255 - (255 - 0) * ratio), 255))
-                            b_comp = 0
-                            color_hex = f'{r_comp:02X}{g_comp:02X}{b_comp:02X}'
-                            cell.fill = PatternFill(start_color=color_hex, end_color=color_hex, fill_type='solid')
-                        else: cell.fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid') 
-                    else: cell.fill = dark_red_fill_main
-            
-            elif presence_col_df_idx is not None and df_col_idx == presence_col_df_idx:
-                if str(value) == 'Present in Both': cell.fill = dark_green_fill_main
-                elif str(value) in ['Present in excel', 'Present in PBI']: cell.fill = dark_red_fill_main
-    
-    if not df.empty:
-        summary_row_blue = '80BBD9'
-        summary_fill = PatternFill(start_color=summary_row_blue, end_color=summary_row_blue, fill_type='solid')
-        header_row_darker_blue = '609AB9'
-        header_fill = PatternFill(start_color=header_row_darker_blue, end_color=header_row_darker_blue, fill_type='solid')
-        bold_font = Font(bold=True)
-
-        for col_excel_idx in range(1, ws.max_column + 1): 
-            ws.cell(row=1, column=col_excel_idx).font = bold_font
-            ws.cell(row=1, column=col_excel_idx).fill = header_fill
-        
-        if ws.max_row >= 2: 
-            for col_excel_idx in range(1, ws.max_column + 1):
-                ws.cell(row=2, column=col_excel_idx).font = bold_font
-                ws.cell(row=2, column=col_excel_idx).fill = summary_fill
-
-
-def combine_excel_files(file_list, low_threshold, mid_threshold):
-    if not file_list or len(file_list) > 10:
-        st.error("Please upload 1 to 10 files.")
+    summary_fill = PatternFill(start_color='80BBD9', end_color='80BBD9', fill_type='solid')
+    header_fill = PatternFill(start_color='609AB9', end_color='609AB9', fill_type='solid')
+    bold_font = Font(bold=True)
+
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return None, None
+    summary_values = next(rows, None)
+    if summary_values is None:
+        ws_target.append(list(header)) # Header only: copied unformatted
         return None, None
 
-    first_filename_parts = os.path.splitext(file_list[0].name)[0].split('_')
-    base_name = first_filename_parts[0] if first_filename_parts else os.path.splitext(file_list[0].name)[0]
-    output_filename = f"{base_name}_merged_validation_report.xlsx"
+    diff_col_idxs = [idx for idx, col_name in enumerate(header) if isinstance(col_name, str) and col_name.endswith('_Diff')]
+    presence_col_idx = list(header).index('presence') if 'presence' in header else None
+
+    def styled(value, fill=None, font=None, number_format=None):
+        cell = WriteOnlyCell(ws_target, value=value)
+        if fill is not None: cell.fill = fill
+        if font is not None: cell.font = font
+        if number_format is not None: cell.number_format = number_format
+        return cell
+
+    ws_target.append([styled(value, fill=header_fill, font=bold_font) for value in header])
+    ws_target.append([styled(value, fill=summary_fill, font=bold_font,
+                             number_format='0.00%' if idx in diff_col_idxs and isinstance(value, (int, float)) and not isinstance(value, bool) else None)
+                      for idx, value in enumerate(summary_values)])
+
+    last_row = 2
+    for values in rows:
+        last_row += 1
+        out_row = list(values)
+        for col_idx in diff_col_idxs:
+            value = values[col_idx] if col_idx < len(values) else None
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and pd.notna(value):
+                if native_rules: fill = None
+                elif value <= low_thresh: fill = dark_green_fill_main
+                elif value <= mid_thresh: fill = amber_gradient_fill(value, low_thresh, mid_thresh)
+                else: fill = dark_red_fill_main
+                out_row[col_idx] = styled(value, fill=fill, number_format='0.00%')
+        if presence_col_idx is not None and presence_col_idx < len(values) and not native_rules:
+            value = values[presence_col_idx]
+            if str(value) == 'Present in Both': out_row[presence_col_idx] = styled(value, fill=dark_green_fill_main)
+            elif str(value) in ['Present in excel', 'Present in PBI']: out_row[presence_col_idx] = styled(value, fill=dark_red_fill_main)
+        ws_target.append(out_row)
+
+    if native_rules:
+        add_native_conditional_formatting(ws_target, header, 3, last_row, low_thresh, mid_thresh, amber_gradient=True)
+
+    return page_summary_values(header, summary_values)
+
+
+def unique_output_sheet_name(original_sheet_name, sheet_name_output_counts, used_sheet_names):
+    # sheet_name_output_counts tracks occurrences of *original_sheet_name* to generate initial suffixes;
+    # used_sheet_names is the set of lower-cased names already in the output (Excel ignores case)
+    occurrence_count = sheet_name_output_counts.get(original_sheet_name, 0)
+    sheet_name_output_counts[original_sheet_name] = occurrence_count + 1
+    suffix = f"_{occurrence_count}" if occurrence_count > 0 else ""
+
+    # The name is truncated in front of the suffix so that the suffix survives the 31-character limit
+    final_target_sheet_name = f"{original_sheet_name[:31 - len(suffix)]}{suffix}"
+    clash_resolution_counter = 0
+    while final_target_sheet_name.lower() in used_sheet_names:
+        clash_resolution_counter += 1
+        suffix_for_clash = f"{suffix}({clash_resolution_counter})"
+        final_target_sheet_name = f"{original_sheet_name[:31 - len(suffix_for_clash)]}{suffix_for_clash}"
+    used_sheet_names.add(final_target_sheet_name.lower())
+    return final_target_sheet_name
+
+
+def page_summary_values(header, summary_values):
+    # A2 holds "Avg Diff: X.XX%"; the presence column of row 2 holds "Both: X, Excel: Y, PBI: Z"
+    if header is None or summary_values is None:
+        return None, None
+    presence_val = None
+    if 'presence' in header:
+        presence_col_idx = list(header).index('presence')
+        presence_val = summary_values[presence_col_idx] if presence_col_idx < len(summary_values) else None
+    return summary_values[0], presence_val
 
-    output_buffer = io.BytesIO()
-    output_wb = Workbook()
-    if 'Sheet' in output_wb.sheetnames: output_wb.remove(output_wb['Sheet'])
 
-    data_sheet_names_in_output = []
-    # sheet_name_output_counts tracks occurrences of *original_sheet_name* to generate initial suffixes
-    sheet_name_output_counts = {} 
-    all_pages_summary_data = []
-    total_avg_diff_sum_for_pooled = 0.0
-    num_sheets_for_pooled_avg = 0
+def copy_report_rows(rows, ws_target):
+    # Plain value copy into a normal sheet; formatted afterwards by apply_main_sheet_conditional_formatting
+    header = summary_values = None
+    for row_num, values in enumerate(rows, 1):
+        ws_target.append(values)
+        if row_num == 1: header = values
+        elif row_num == 2: summary_values = values
+    return page_summary_values(header, summary_values)
 
-    for uploaded_file in file_list:
-        file_bytes = uploaded_file.read()
-        try:
-            current_input_wb = load_workbook(filename=io.BytesIO(file_bytes))
-        except Exception as e:
-            st.warning(f"Could not read {uploaded_file.name}: {e}. Skipping this file.")
-            continue
 
-        for original_sheet_name in current_input_wb.sheetnames:
-            if original_sheet_name in ["Column_Checklist", "Diff_Checker_Summary", "All_Pages_Summary"]:
-                continue
+def report_sheet_names(workbook):
+    return [name for name in workbook.sheetnames if name not in ["Column_Checklist", "Diff_Checker_Summary", "All_Pages_Summary", REPORT_METADATA_SHEET, TOP_MISMATCH_SHEET]]
 
-            ws_source = current_input_wb[original_sheet_name]
-            
-            # --- Refined Sheet Naming Logic ---
-            occurrence_count = sheet_name_output_counts.get(original_sheet_name, 0)
-            sheet_name_output_counts[original_sheet_name] = occurrence_count + 1
-
-            candidate_sheet_name = original_sheet_name
-            if occurrence_count > 0: # Not the first time we've seen this original_sheet_name
-                suffix = f"_{occurrence_count}"
-                # Try to keep original name + suffix, then truncate
-                candidate_sheet_name = f"{original_sheet_name}{suffix}"
-            
-            # Truncate the candidate name if it's too long
-            truncated_candidate_name = candidate_sheet_name[:31]
-
-            # Ensure uniqueness of the (potentially truncated) name in the output workbook
-            final_target_sheet_name = truncated_candidate_name
-            clash_resolution_counter = 0
-            while final_target_sheet_name in output_wb.sheetnames:
-                clash_resolution_counter += 1
-                # If truncated_candidate_name was already 31 chars, we need to shorten it to add suffix
-                base_for_clash_suffix = truncated_candidate_name
-                suffix_for_clash = f"({clash_resolution_counter})"
-                
-                if len(base_for_clash_suffix) + len(suffix_for_clash) > 31:
-                    base_for_clash_suffix = base_for_clash_suffix[:31 - len(suffix_for_clash)]
-                
-                final_target_sheet_name = f"{base_for_clash_suffix}{suffix_for_clash}"
-                if clash_resolution_counter > 50: # Safety break
-                    st.error(f"Extreme difficulty generating unique name for {original_sheet_name}")
-                    final_target_sheet_name = f"ERR_NAME_{len(output_wb.sheetnames)}"[:31] # Fallback
-                    break
-            # --- End of Refined Sheet Naming Logic ---
-            
-            data_sheet_names_in_output.append(final_target_sheet_name)
-            ws_target = output_wb.create_sheet(title=final_target_sheet_name)
-            for row in ws_source.rows: 
-                for cell in row: ws_target[cell.coordinate].value = cell.value
-            
-            avg_diff_display_text = "N/A"
-            presence_display_text = "N/A"
-            avg_diff_numeric = None
-
-            if ws_source.max_row >= 2:
-                a2_val = ws_source.cell(row=2, column=1).value
-                if a2_val and isinstance(a2_val, str) and "Avg Diff:" in a2_val:
-                    avg_diff_display_text = a2_val 
-                    try:
-                        perc_str = avg_diff_display_text.split("Avg Diff:")[1].strip().replace('%', '')
-                        avg_diff_numeric = float(perc_str) / 100.0
-                        total_avg_diff_sum_for_pooled += avg_diff_numeric
-                        num_sheets_for_pooled_avg += 1
-                    except (IndexError, ValueError): avg_diff_numeric = None
-                elif pd.notna(a2_val) : avg_diff_display_text = str(a2_val)
-
-                presence_col_idx_src = None
-                for col_scan in range(1, ws_source.max_column + 1):
-                    if ws_source.cell(row=1, column=col_scan).value == 'presence':
-                        presence_col_idx_src = col_scan; break
-                if presence_col_idx_src: presence_display_text = str(ws_source.cell(row=2, column=presence_col_idx_src).value or "N/A")
-            
-            display_name_for_summary = final_target_sheet_name # Use the actual unique name in output
-            suffixes_to_remove = ["_validation_report", "_val_report", "_validationreport", "_val"] 
-            # For display in summary, try to clean it further
-            cleaned_display_name = final_target_sheet_name 
-            for suffix in suffixes_to_remove:
-                if cleaned_display_name.lower().endswith(suffix.lower()): 
-                    cleaned_display_name = cleaned_display_name[:-len(suffix)]
-                    break 
-            if not cleaned_display_name.strip(): cleaned_display_name = final_target_sheet_name
-
-            all_pages_summary_data.append({
-                'Display Sheet Name': cleaned_display_name, # Use the further cleaned name for display
-                'Actual Sheet Name': final_target_sheet_name, # Keep track of actual name if needed
-                'Presence': presence_display_text,
-                'Avg Diff Numeric': avg_diff_numeric,
-                'Avg Diff Original Text': avg_diff_display_text 
-            })
-
-    for sheet_name_to_fmt in data_sheet_names_in_output:
-        if sheet_name_to_fmt in output_wb.sheetnames:
-            apply_main_sheet_conditional_formatting(output_wb[sheet_name_to_fmt], sheet_name_to_fmt, output_wb, low_threshold, mid_threshold)
 
-    summary_page_title = "All_Pages_Summary"
-    if summary_page_title in output_wb.sheetnames: del output_wb[summary_page_title]
-    summary_ws = output_wb.create_sheet(title=summary_page_title, index=0)
-    
-    headers = ["Sheet Name", "Presence", "Avg Diff"]
-    for col_num, header_text in enumerate(headers, 1):
-        summary_ws.cell(row=1, column=col_num, value=header_text).font = Font(bold=True)
+def read_report_metadata(workbook):
+    # Reports written before the metadata sheet existed return None and fall back to parsing A2
+    if REPORT_METADATA_SHEET not in workbook.sheetnames:
+        return None
+    try:
+        return parse_report_metadata(workbook.iter_rows(REPORT_METADATA_SHEET))
+    except Exception:
+        return None
+
+
+def extract_report_payload(file_name, file_bytes, reader_backend=None):
+    """
+    Parses one uploaded report in a worker process. Returns the value rows of each report sheet,
+    in sheet order, and the report metadata, or the error message if the file could not be read.
+    """
+    try:
+        wb = open_workbook(file_bytes, reader_backend)
+    except Exception as e:
+        return {'file_name': file_name, 'error': str(e), 'sheets': [], 'metadata': None}
+    try:
+        metadata = read_report_metadata(wb)
+        sheets = [(name, list(wb.iter_rows(name))) for name in report_sheet_names(wb)]
+    finally:
+        wb.close()
+    return {'file_name': file_name, 'error': None, 'sheets': sheets, 'metadata': metadata}
+
+
+def iter_report_sources(file_list, max_workers=1, reader_backend=None):
+    """
+    Yields (file_name, error, [(sheet_name, rows)], metadata) for each upload, in upload order.
+    With max_workers > 1 the files are parsed in a process pool, at most 2 * max_workers ahead
+    of the consumer; otherwise each file is streamed row by row from a read-only workbook.
+    reader_backend picks the readers.py backend (None = auto).
+    """
+    if max_workers <= 1:
+        for uploaded_file in file_list:
+            try:
+                wb = open_workbook(uploaded_file.read(), reader_backend)
+            except Exception as e:
+                yield uploaded_file.name, str(e), [], None
+                continue
+            try:
+                metadata = read_report_metadata(wb)
+                yield uploaded_file.name, None, [(name, wb.iter_rows(name)) for name in report_sheet_names(wb)], metadata
+            finally:
+                wb.close()
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        files = iter(file_list)
+        for uploaded_file in itertools.islice(files, 2 * max_workers):
+            pending.append(executor.submit(extract_report_payload, uploaded_file.name, uploaded_file.read(), reader_backend))
+        while pending:
+            payload = pending.popleft().result()
+            next_file = next(files, None)
+            if next_file is not None:
+                pending.append(executor.submit(extract_report_payload, next_file.name, next_file.read(), reader_backend))
+            yield payload['file_name'], payload['error'], payload['sheets'], payload['metadata']
+
+
+def page_summary_entry(final_target_sheet_name, a2_val, presence_val, metadata=None):
+    avg_diff_display_text = "N/A"
+    avg_diff_numeric = None
+    if metadata and isinstance(metadata.get('avg_diff'), (int, float)):
+        # Exact values from the report's metadata sheet; no string parsing needed
+        avg_diff_numeric = float(metadata['avg_diff'])
+        avg_diff_display_text = f"Avg Diff: {avg_diff_numeric * 100:.2f}%"
+        presence_val = f"Both: {metadata.get('presence_both')}, Excel: {metadata.get('presence_excel_only')}, PBI: {metadata.get('presence_pbi_only')}"
+    elif a2_val and isinstance(a2_val, str) and "Avg Diff:" in a2_val:
+        avg_diff_display_text = a2_val
+        try:
+            perc_str = avg_diff_display_text.split("Avg Diff:")[1].strip().replace('%', '')
+            avg_diff_numeric = float(perc_str) / 100.0
+        except (IndexError, ValueError): avg_diff_numeric = None
+    elif pd.notna(a2_val): avg_diff_display_text = str(a2_val)
+    presence_display_text = str(presence_val or "N/A")
+
+    suffixes_to_remove = ["_validation_report", "_val_report", "_validationreport", "_val"]
+    # For display in summary, try to clean it further
+    cleaned_display_name = final_target_sheet_name
+    for suffix in suffixes_to_remove:
+        if cleaned_display_name.lower().endswith(suffix.lower()):
+            cleaned_display_name = cleaned_display_name[:-len(suffix)]
+            break
+    if not cleaned_display_name.strip(): cleaned_display_name = final_target_sheet_name
+
+    return {
+        'Display Sheet Name': cleaned_display_name, # Use the further cleaned name for display
+        'Actual Sheet Name': final_target_sheet_name, # Keep track of actual name if needed
+        'Presence': presence_display_text,
+        'Avg Diff Numeric': avg_diff_numeric,
+        'Avg Diff Original Text': avg_diff_display_text
+    }
+
+
+def write_all_pages_summary(summary_ws, all_pages_summary_data, low_threshold, mid_threshold, native_rules=False):
+    # Rows are appended as cells so the same code writes normal and write-only sheets
     summary_ws.column_dimensions['A'].width = 35
     summary_ws.column_dimensions['B'].width = 45
     summary_ws.column_dimensions['C'].width = 20
 
+    def bold(value):
+        cell = WriteOnlyCell(summary_ws, value=value)
+        cell.font = Font(bold=True)
+        return cell
+
+    summary_ws.append([bold(header_text) for header_text in ["Sheet Name", "Presence", "Avg Diff"]])
+
     dark_green_fill_summary = PatternFill(start_color='19D119', end_color='19D119', fill_type='solid')
     dark_red_fill_summary = PatternFill(start_color='E82D1C', end_color='E82D1C', fill_type='solid')
 
-    summary_row_idx = 2
+    total_avg_diff_sum_for_pooled = 0.0
+    num_sheets_for_pooled_avg = 0
     for item in all_pages_summary_data:
-        summary_ws.cell(row=summary_row_idx, column=1, value=item['Display Sheet Name']) # Show cleaned name
-        summary_ws.cell(row=summary_row_idx, column=2, value=item['Presence'])
-        
         avg_diff_val_numeric = item['Avg Diff Numeric']
-        cell_c_summary = summary_ws.cell(row=summary_row_idx, column=3)
-
         if avg_diff_val_numeric is not None and isinstance(avg_diff_val_numeric, (float, int)):
-            cell_c_summary.value = avg_diff_val_numeric
+            total_avg_diff_sum_for_pooled += avg_diff_val_numeric
+            num_sheets_for_pooled_avg += 1
+            cell_c_summary = WriteOnlyCell(summary_ws, value=avg_diff_val_numeric)
             cell_c_summary.number_format = '0.00%'
-            if avg_diff_val_numeric <= low_threshold: cell_c_summary.fill = dark_green_fill_summary 
-            elif avg_diff_val_numeric <= mid_threshold:
-                if mid_threshold > low_threshold:
-                    ratio = (avg_diff_val_numeric - low_threshold) / (mid_threshold - low_threshold)
-                    r_comp = max(0, min(int(255 + (139 - 255) * ratio), 255))
-                    g_comp = max(0, min(int(255 - (255 - 0) * ratio), 255))
-                    b_comp = 0
-                    color_hex = f'{r_comp:02X}{g_comp:02X}{b_comp:02X}'
-                    cell_c_summary.fill = PatternFill(start_color=color_hex, end_color=color_hex, fill_type='solid')
-                else: cell_c_summary.fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
+            if native_rules: pass  # Coloured by the column rules added below
+            elif avg_diff_val_numeric <= low_threshold: cell_c_summary.fill = dark_green_fill_summary 
+            elif avg_diff_val_numeric <= mid_threshold: cell_c_summary.fill = amber_gradient_fill(avg_diff_val_numeric, low_threshold, mid_threshold)
             else: cell_c_summary.fill = dark_red_fill_summary
         else: 
-             cell_c_summary.value = item['Avg Diff Original Text'] 
-        summary_row_idx += 1
-    
-    summary_ws.cell(row=summary_row_idx, column=1, value="Pooled Average").font = Font(bold=True)
+            cell_c_summary = item['Avg Diff Original Text']
+        summary_ws.append([item['Display Sheet Name'], item['Presence'], cell_c_summary]) # Show cleaned name
+
+    summary_row_idx = len(all_pages_summary_data) + 2
+    if native_rules and summary_row_idx > 2:
+        add_diff_threshold_rules(summary_ws, f'C2:C{summary_row_idx - 1}', 'C2', low_threshold, mid_threshold, amber_gradient=True)
+
     if num_sheets_for_pooled_avg > 0:
         pooled_avg = total_avg_diff_sum_for_pooled / num_sheets_for_pooled_avg
-        cell_pooled_c = summary_ws.cell(row=summary_row_idx, column=3, value=pooled_avg)
+        cell_pooled_c = bold(pooled_avg)
         cell_pooled_c.number_format = '0.00%'
-        cell_pooled_c.font = Font(bold=True)
     else:
-        summary_ws.cell(row=summary_row_idx, column=3, value="N/A").font = Font(bold=True)
+        cell_pooled_c = bold("N/A")
+    summary_ws.append([bold("Pooled Average"), None, cell_pooled_c])
+
+
+def count_rows(rows, entry):
+    # Counts rows into a StageRecorder entry as they stream past
+    for row in rows:
+        entry['rows'] += 1
+        yield row
+
+
+def combine_excel_files(file_list, low_threshold, mid_threshold, native_rules=False, streaming=None, max_workers=1, progress_callback=None, recorder=None):
+    """
+    Merges validation reports into one workbook with an All_Pages_Summary sheet first.
+    streaming=True appends formatted rows to a write-only output, so memory stays bounded by one row
+    instead of all input workbooks plus the output; streaming=None picks it automatically for more
+    than STREAMING_MERGE_MIN_FILES files. max_workers > 1 parses the inputs in a process pool; only
+    sheet naming and the ordered assembly stay serial. Each worker hands back one report's sheets and
+    at most 2 * max_workers reports are in flight, so a streaming merge with a pool is bounded by
+    those reports rather than by one row. progress_callback(done, total, file_name) is
+    called after each file. recorder (instrument.StageRecorder) records the read / format / summary / save stages.
+    Returns (output_buffer, output_filename, file_errors); file_errors maps the name of each report that
+    could not be read, and so was left out of the merge, to its error message.
+    """
+    if not file_list:
+        st.error("Please upload at least one file.")
+        return None, None, {}
+    if streaming is None:
+        streaming = len(file_list) > STREAMING_MERGE_MIN_FILES
+
+    first_filename_parts = os.path.splitext(file_list[0].name)[0].split('_')
+    base_name = first_filename_parts[0] if first_filename_parts else os.path.splitext(file_list[0].name)[0]
+    output_filename = f"{base_name}_merged_validation_report.xlsx"
+
+    output_buffer = io.BytesIO()
+    output_wb = Workbook(write_only=streaming)
+    if 'Sheet' in output_wb.sheetnames: output_wb.remove(output_wb['Sheet'])
+
+    summary_page_title = "All_Pages_Summary"
+    # Write-only sheets cannot be revisited: the summary sheet is created up front and filled at the end
+    summary_ws = output_wb.create_sheet(title=summary_page_title) if streaming else None
+    used_sheet_names = {summary_page_title.lower()}
+
+    data_sheet_names_in_output = []
+    sheet_name_output_counts = {} 
+    all_pages_summary_data = []
+    file_errors = {}
+
+    # The streaming merge keeps openpyxl, whose read-only mode streams rows; calamine loads whole sheets
+    reader_backend = 'openpyxl' if streaming else None
+    with stage(recorder, 'read_and_copy', 0) as read_entry:
+        for files_done, (file_name, error, report_sheets, metadata) in enumerate(iter_report_sources(file_list, max_workers, reader_backend), 1):
+            if error is not None:
+                file_errors[file_name] = error
+                if progress_callback: progress_callback(files_done, len(file_list), file_name)
+                continue
+
+            for original_sheet_name, rows in report_sheets:
+                if recorder is not None:
+                    rows = count_rows(rows, read_entry)
+                final_target_sheet_name = unique_output_sheet_name(original_sheet_name, sheet_name_output_counts, used_sheet_names)
+                data_sheet_names_in_output.append(final_target_sheet_name)
+                ws_target = output_wb.create_sheet(title=final_target_sheet_name)
+
+                if streaming:
+                    a2_val, presence_val = stream_report_rows(rows, ws_target, low_threshold, mid_threshold, native_rules)
+                    ws_target.close() # Flush to its temp file now so hundreds of sheets do not keep files open
+                else:
+                    a2_val, presence_val = copy_report_rows(rows, ws_target)
+
+                # The metadata describes the report sheet it was written for; other sheets fall back to A2
+                sheet_metadata = metadata if metadata and metadata.get('report_sheet') == original_sheet_name else None
+                all_pages_summary_data.append(page_summary_entry(final_target_sheet_name, a2_val, presence_val, sheet_metadata))
+
+            if progress_callback: progress_callback(files_done, len(file_list), file_name)
+
+    if not streaming:
+        with stage(recorder, 'format', read_entry.get('rows')):
+            for sheet_name_to_fmt in data_sheet_names_in_output:
+                if sheet_name_to_fmt in output_wb.sheetnames:
+                    apply_main_sheet_conditional_formatting(output_wb[sheet_name_to_fmt], low_threshold, mid_threshold, native_rules)
+
+        if summary_page_title in output_wb.sheetnames: del output_wb[summary_page_title]
+        summary_ws = output_wb.create_sheet(title=summary_page_title, index=0)
+
+    with stage(recorder, 'summary', len(all_pages_summary_data)):
+        write_all_pages_summary(summary_ws, all_pages_summary_data, low_threshold, mid_threshold, native_rules)
 
     final_ordered_sheet_names = [summary_page_title] + [name for name in data_sheet_names_in_output if name != summary_page_title]
     if final_ordered_sheet_names: 
         output_wb._sheets = [output_wb[name] for name in final_ordered_sheet_names if name in output_wb.sheetnames]
 
-    output_wb.save(output_buffer)
+    with stage(recorder, 'save', read_entry.get('rows')):
+        output_wb.save(output_buffer)
     output_buffer.seek(0)
-    return output_buffer, output_filename
+    return output_buffer, output_filename, file_errors
 
 
 def run():
@@ -273,12 +445,16 @@ def run():
     st.sidebar.header("⚙️ Diff Color Thresholds")
     low_threshold = st.sidebar.number_input("Green Threshold (≤)", min_value=0.0, max_value=1.0, value=0.05, step=0.01, key="mrg_low_threshold_sidebar")
     mid_threshold = st.sidebar.number_input("Amber Threshold (≤)", min_value=0.0, max_value=1.0, value=0.5, step=0.01, key="mrg_mid_threshold_sidebar")
+    native_rules = st.sidebar.checkbox("Native Excel conditional formatting", value=False, key="mrg_native_rules_sidebar", help="Colour cells with a few Excel conditional-formatting rules instead of per-cell fills. Smaller files, and thresholds can be changed later in Excel.")
+    streaming = st.sidebar.checkbox("Streaming merge", value=False, key="mrg_streaming_sidebar", help=f"Read the reports row by row and write the merged file in a single pass, keeping memory bounded by one row, or by 2 reports per parser process when parsing in parallel. Always used for more than {STREAMING_MERGE_MIN_FILES} files.")
+    max_workers = st.sidebar.number_input("Parser processes", min_value=1, max_value=os.cpu_count() or 1, value=1, step=1, key="mrg_max_workers_sidebar", help="Parse the uploaded reports in parallel worker processes.")
+    record_stages, trace_memory = instrumentation_options("mrg")
 
     st.markdown("""
     <div class="instructions">
     <h3 style="color: #4682B4;">How to Use:</h3>
     <ul>
-        <li>Upload up to 10 Excel files (outputs from Validation Report Generator).</li>
+        <li>Upload one or more Excel files (outputs from Validation Report Generator). Hundreds of files can be merged in one run.</li>
         <li>Click the "Merge and Summarize Files" button.</li>
         <li>Sheets from each file will be merged. An "All_Pages_Summary" sheet will be added first.</li>
         <li>Duplicate sheet names get a numeric suffix (e.g., 'Sheet_1'). Sheet names are limited to 31 characters.</li>
@@ -291,38 +467,40 @@ def run():
         "Drop Your Validation Excel Files Here!",
         type=["xlsx", "xls"],
         accept_multiple_files=True,
-        help="Upload up to 10 validation Excel files.",
+        help="Upload the validation Excel files to merge.",
         key="mrg_file_uploader_main"
     )
 
     if uploaded_files:
-        if len(uploaded_files) > 10:
-            st.markdown(
-                '<div class="error-box">Whoops! Maximum 10 files allowed. Please upload fewer files.</div>',
-                unsafe_allow_html=True
-            )
-        else:
-            st.markdown(f'<div class="file-list"><strong>Uploaded {len(uploaded_files)} File(s):</strong>', unsafe_allow_html=True)
+        st.markdown(f'<div class="file-list"><strong>Uploaded {len(uploaded_files)} File(s):</strong>', unsafe_allow_html=True)
+        with st.expander("Show file names", expanded=len(uploaded_files) <= 10):
             for file_obj_display in uploaded_files:
                 st.markdown(f"- {file_obj_display.name}", unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-
-            if st.button("Merge and Summarize Files", key="mrg_merge_process_button"):
-                with st.spinner("Merging your files and generating summary... Hang tight!"):
-                    result = combine_excel_files(uploaded_files, low_threshold, mid_threshold)
-                    if result:
-                        output_buffer, output_filename = result
-                        st.markdown(
-                            f'<div class="success-box">Success! Your merged file is ready: <strong>{output_filename}</strong></div>',
-                            unsafe_allow_html=True
-                        )
-                        st.download_button(
-                            label="Download Your Merged Excel!",
-                            data=output_buffer,
-                            file_name=output_filename,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            key="mrg_download_merged_button"
-                        )
+        st.markdown('</div>', unsafe_allow_html=True)
+
+        if st.button("Merge and Summarize Files", key="mrg_merge_process_button"):
+            with st.spinner("Merging your files and generating summary... Hang tight!"):
+                progress_bar = st.progress(0.0, text="Merging files...")
+                def report_progress(done, total, file_name):
+                    progress_bar.progress(done / total, text=f"Merged {done}/{total}: {file_name}")
+                recorder = StageRecorder('mrg', trace_memory, context={'files': len(uploaded_files), 'native_rules': native_rules, 'streaming': streaming, 'max_workers': int(max_workers)}) if record_stages else None
+                output_buffer, output_filename, file_errors = combine_excel_files(uploaded_files, low_threshold, mid_threshold, native_rules,
+                                                                                  streaming or None, int(max_workers), progress_callback=report_progress, recorder=recorder)
+                for file_name, error in file_errors.items():
+                    st.warning(f"Could not read {file_name}: {error}. Skipping this file.")
+                if output_buffer is not None:
+                    st.markdown(
+                        f'<div class="success-box">Success! Your merged file is ready: <strong>{output_filename}</strong></div>',
+                        unsafe_allow_html=True
+                    )
+                    st.download_button(
+                        label="Download Your Merged Excel!",
+                        data=output_buffer,
+                        file_name=output_filename,
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        key="mrg_download_merged_button"
+                    )
+                    show_stage_timings(recorder, os.path.splitext(output_filename)[0])
 
 if __name__ == "__main__":
     run()
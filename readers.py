@@ -0,0 +1,140 @@
+# readers.py
+import datetime
+import io
+import os
+import sys
+import time
+import pandas as pd
+from openpyxl import load_workbook
+
+# python-calamine (a Rust xlsx parser) is optional; without it every read goes through openpyxl
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+# Backends in order of preference; "auto" picks the first one that is installed.
+# VALIDATOR_READER_BACKEND=openpyxl forces the pure-Python reader.
+READER_BACKENDS = ["calamine", "openpyxl"]
+READER_BACKEND = os.environ.get("VALIDATOR_READER_BACKEND", "auto")
+
+
+def available_backends():
+    return [backend for backend in READER_BACKENDS if backend != "calamine" or python_calamine is not None]
+
+
+def resolve_backend(backend=None):
+    backend = backend or READER_BACKEND
+    if backend == "auto":
+        return available_backends()[0]
+    if backend not in available_backends():
+        raise ValueError(f"Reader backend '{backend}' is not available. Installed backends: {', '.join(available_backends())}.")
+    return backend
+
+
+def as_source(workbook_source):
+    return io.BytesIO(workbook_source) if isinstance(workbook_source, (bytes, bytearray)) else workbook_source
+
+
+def read_sheet(file_bytes, sheet_name, backend=None):
+    """
+    pd.read_excel of one sheet with the selected backend. Raises ValueError if the sheet does not exist.
+    """
+    xl = pd.ExcelFile(io.BytesIO(file_bytes), engine=resolve_backend(backend))
+    if sheet_name not in xl.sheet_names:
+        raise ValueError(f"Sheet '{sheet_name}' not found in the uploaded file.")
+    return xl.parse(sheet_name)
+
+
+class OpenpyxlWorkbookReader:
+    """Row-by-row reader over an openpyxl read-only workbook."""
+    def __init__(self, workbook_source):
+        self.workbook = load_workbook(as_source(workbook_source), read_only=True, data_only=True)
+        self.sheetnames = self.workbook.sheetnames
+
+    def iter_rows(self, sheet_name):
+        return self.workbook[sheet_name].iter_rows(values_only=True)
+
+    def close(self):
+        self.workbook.close()
+
+
+class CalamineWorkbookReader:
+    """
+    Row-by-row reader over python-calamine. Rows come out like openpyxl's
+    iter_rows(values_only=True): padded from A1, None for empty cells, whole numbers as int
+    and dates as datetime.
+    """
+    def __init__(self, workbook_source):
+        self.workbook = python_calamine.CalamineWorkbook.from_filelike(as_source(workbook_source))
+        self.sheetnames = self.workbook.sheet_names
+
+    def iter_rows(self, sheet_name):
+        sheet = self.workbook.get_sheet_by_name(sheet_name)
+        first_row, first_col = sheet.start if sheet.start else (0, 0)
+        width = first_col + sheet.width
+        for _ in range(first_row):
+            yield (None,) * width
+        for row in sheet.iter_rows():
+            yield (None,) * first_col + tuple(calamine_value(value) for value in row)
+
+    def close(self):
+        self.workbook.close()
+
+
+def calamine_value(value):
+    if value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return datetime.datetime(value.year, value.month, value.day)
+    return value
+
+
+def open_workbook(workbook_source, backend=None):
+    """
+    Opens bytes or a file-like object for row iteration with the selected backend. The reader has
+    .sheetnames, .iter_rows(sheet_name) and .close().
+    """
+    if resolve_backend(backend) == "calamine":
+        return CalamineWorkbookReader(workbook_source)
+    return OpenpyxlWorkbookReader(workbook_source)
+
+
+def benchmark_backends(file_bytes, sheet_names=None, repeat=3):
+    """
+    Times each installed backend on the same workbook. Returns {backend: {'frames': s, 'rows': s}}
+    with the best of `repeat` runs for pd.read_excel of the sheets and for iterating their rows.
+    """
+    results = {}
+    for backend in available_backends():
+        sheets = sheet_names or open_workbook(file_bytes, backend).sheetnames
+        frame_times, row_times = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for sheet_name in sheets:
+                read_sheet(file_bytes, sheet_name, backend)
+            frame_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            reader = open_workbook(file_bytes, backend)
+            try:
+                for sheet_name in sheets:
+                    for _ in reader.iter_rows(sheet_name):
+                        pass
+            finally:
+                reader.close()
+            row_times.append(time.perf_counter() - started)
+        results[backend] = {"frames": round(min(frame_times), 3), "rows": round(min(row_times), 3)}
+    return results
+
+
+if __name__ == "__main__":
+    # python readers.py WORKBOOK.xlsx [SHEET ...] -- parse time per installed backend
+    if len(sys.argv) < 2:
+        sys.exit("usage: python readers.py WORKBOOK.xlsx [SHEET ...]")
+    with open(sys.argv[1], "rb") as f:
+        workbook_bytes = f.read()
+    for backend_name, timings in benchmark_backends(workbook_bytes, sys.argv[2:] or None).items():
+        print(f"{backend_name:>10}: read_excel {timings['frames']:.3f}s, rows {timings['rows']:.3f}s")
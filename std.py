@@ -1,8 +1,14 @@
 import streamlit as st
 import pandas as pd
 import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 import base64
+from pandas.tseries.api import guess_datetime_format
+from cache import read_excel_cached
+from instrument import StageRecorder, instrumentation_options, show_stage_timings, stage
 
 # This function is not used in the main logic but kept as it was in the original code
 def get_base64_image(image_path):
@@ -14,52 +20,180 @@ def get_base64_image(image_path):
         st.error(f"Image not found at {image_path}")
         return None
 
-def standardize_column_data(df1_orig, df2_orig, common_columns):
+# Type inference looks at an evenly spaced sample of each column's non-null values first, so only
+# the one conversion that will actually be applied runs over the full column.
+TYPE_SAMPLE_SIZE = 500
+DATE_SAMPLE_MIN_MATCH = 0.9 # Share of sampled values that must parse for a column to be treated as dates
+
+def sample_values(series, sample_size=TYPE_SAMPLE_SIZE):
+    """Returns up to sample_size evenly spaced non-null values of the series."""
+    non_null = series.dropna()
+    if len(non_null) > sample_size:
+        non_null = non_null.iloc[::len(non_null) // sample_size][:sample_size]
+    return non_null
+
+def sample_is_numeric(sample):
+    # A sample is a subset of the column, so if it fails the full column would fail too
+    try:
+        pd.to_numeric(sample)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+def infer_date_format(sample):
     """
-    Standardizes data types of common columns with a clear priority:
+    Returns (is_date, date_format) for a column sample. date_format is an explicit strptime format
+    detected from the values, or None when the values are already datetimes (or numbers) that need
+    no format. Text is never parsed with format='mixed': per-value guessing would read 02/01/2024
+    month-first and 13/01/2024 day-first in the same column, so a column no single format fits
+    is not a date column.
+    """
+    if sample.empty:
+        return False, None
+    strings = sample[sample.map(type) == str]
+    if strings.empty:
+        candidate_formats = [None]
+    else:
+        # Month-first and day-first guesses differ for values like 02/01/2024; both are tried
+        candidate_formats = []
+        for dayfirst in (False, True):
+            detected_format = guess_datetime_format(strings.iloc[0], dayfirst=dayfirst)
+            if detected_format and detected_format not in candidate_formats:
+                candidate_formats.append(detected_format)
+
+    best_format, best_match = None, 0.0
+    for date_format in candidate_formats:
+        match = pd.to_datetime(sample, format=date_format, errors='coerce').notna().mean()
+        # Strictly better only, so month-first wins when every value fits both orders
+        if match > best_match:
+            best_format, best_match = date_format, match
+    if best_match >= DATE_SAMPLE_MIN_MATCH:
+        return True, best_format
+    return False, None
+
+def strip_text_per_value(series):
+    """astype(str).str.strip() applied once per distinct value; returns a categorical."""
+    codes, uniques = pd.factorize(series)
+    stripped = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    missing = codes < 0
+    if missing.any():
+        # factorize folds None / NaN / NaT together; keep their own text ('None', 'nan', 'NaT')
+        missing_codes, missing_text = pd.factorize(series[missing].astype(str))
+        codes[missing] = missing_codes + len(stripped)
+        stripped = pd.concat([stripped, pd.Series(missing_text, dtype=object)], ignore_index=True)
+    stripped_codes, categories = pd.factorize(stripped)
+    return pd.Series(pd.Categorical.from_codes(stripped_codes[codes], categories=categories), index=series.index, name=series.name)
+
+def standardize_column_pair(series1, series2, compact_dtypes=False):
+    """
+    Standardizes one common column of both frames and returns the converted pair, with a clear priority:
     1. Numeric: If both columns can be treated as numbers.
     2. Datetime: If they can be parsed as dates (time is removed).
     3. String: As a final fallback.
+    The type is inferred from a sample of each column; the full columns are converted once.
+    compact_dtypes keeps dates as datetime64 (time set to midnight) and strings as categoricals.
     """
-    df1 = df1_orig.copy()
-    df2 = df2_orig.copy()
+    sample1 = sample_values(series1)
+    sample2 = sample_values(series2)
 
-    for col in common_columns:
-        # Step 1: Attempt Numeric Conversion
-        # This is a good first check for obviously numeric columns.
+    # Step 1: Attempt Numeric Conversion
+    # Only tried on the full columns when both samples are numeric.
+    if sample_is_numeric(sample1) and sample_is_numeric(sample2):
         try:
-            df1_numeric = pd.to_numeric(df1[col])
-            df2_numeric = pd.to_numeric(df2[col])
             # If both conversions succeed without error, apply them
-            df1[col] = df1_numeric
-            df2[col] = df2_numeric
-            # Continue to the next column
-            continue
+            return pd.to_numeric(series1), pd.to_numeric(series2)
         except (ValueError, TypeError):
-            # If conversion to numeric fails, proceed to check for dates.
+            # A value outside the samples is not numeric; proceed to check for dates.
             pass
 
-        # Step 2: Attempt Datetime Conversion
-        # Use errors='coerce' to turn un-parsable values into NaT (Not a Time)
-        temp_dt1 = pd.to_datetime(df1[col], errors='coerce')
-        temp_dt2 = pd.to_datetime(df2[col], errors='coerce')
-        
-        # Condition: Proceed if the conversion resulted in at least one valid date
-        # in EACH dataframe, preventing columns of names/text from being converted.
-        if not temp_dt1.isnull().all() and not temp_dt2.isnull().all():
-            # Apply the conversion and use .dt.date to STRIP the time component
-            df1[col] = temp_dt1.dt.date
-            df2[col] = temp_dt2.dt.date
-            # Continue to the next column
-            continue
-
-        # Step 3: Default to String Conversion
-        # This runs only if both numeric and date conversions fail.
-        df1[col] = df1[col].astype(str).str.strip()
-        df2[col] = df2[col].astype(str).str.strip()
-            
+    # Step 2: Attempt Datetime Conversion
+    # Both samples must mostly parse as dates, preventing columns of names/text from being
+    # converted. Each side is parsed with its own detected format; errors='coerce' turns
+    # un-parsable values into NaT (Not a Time).
+    is_date1, date_format1 = infer_date_format(sample1)
+    is_date2, date_format2 = infer_date_format(sample2) if is_date1 else (False, None)
+    if is_date1 and is_date2:
+        dates1 = pd.to_datetime(series1, format=date_format1, errors='coerce')
+        dates2 = pd.to_datetime(series2, format=date_format2, errors='coerce')
+        if compact_dtypes:
+            # normalize() strips the time but stays datetime64
+            return dates1.dt.normalize(), dates2.dt.normalize()
+        # Apply the conversion and use .dt.date to STRIP the time component
+        return dates1.dt.date, dates2.dt.date
+
+    # Step 3: Default to String Conversion
+    # This runs only if both numeric and date conversions fail.
+    if compact_dtypes:
+        return strip_text_per_value(series1), strip_text_per_value(series2)
+    return series1.astype(str).str.strip(), series2.astype(str).str.strip()
+
+def standardize_column_data(df1_orig, df2_orig, common_columns, max_workers=1, compact_dtypes=False):
+    """
+    Standardizes data types of common columns (see standardize_column_pair).
+    With max_workers > 1 the columns are converted in a process pool, at most 2 * max_workers
+    columns in flight, and written back in the original column order.
+    """
+    df1 = df1_orig.copy()
+    df2 = df2_orig.copy()
+
+    if max_workers <= 1 or len(common_columns) <= 1:
+        for col in common_columns:
+            df1[col], df2[col] = standardize_column_pair(df1[col], df2[col], compact_dtypes)
+        return df1, df2
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        columns = iter(common_columns)
+        for col in itertools.islice(columns, 2 * max_workers):
+            pending.append((col, executor.submit(standardize_column_pair, df1[col], df2[col], compact_dtypes)))
+        while pending:
+            col, future = pending.popleft()
+            df1[col], df2[col] = future.result()
+            next_col = next(columns, None)
+            if next_col is not None:
+                pending.append((next_col, executor.submit(standardize_column_pair, df1[next_col], df2[next_col], compact_dtypes)))
     return df1, df2
 
+def write_standardized_sheet(writer, df, sheet_name):
+    df.to_excel(writer, sheet_name=sheet_name, index=False)
+    # Compact-mode dates are datetime64; give them the same date-only format as date objects
+    # (the openpyxl writer ignores ExcelWriter's datetime_format)
+    ws = writer.sheets[sheet_name]
+    for col_idx, col in enumerate(df.columns, 1):
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            for (cell,) in ws.iter_rows(min_row=2, max_row=len(df) + 1, min_col=col_idx, max_col=col_idx):
+                cell.number_format = 'YYYY-MM-DD'
+
+def standardize_workbook(file_bytes, max_workers=1, compact_dtypes=False, recorder=None):
+    """
+    Reads the 'excel' and 'PBI' sheets, standardizes their common columns (in max_workers
+    processes) and returns
+    (BytesIO of the standardized workbook, common_columns). Returns (None, []) when the
+    sheets share no columns; a missing sheet raises ValueError.
+    """
+    # Parsed sheets are cached on disk by content hash, so reruns skip the xlsx parse.
+    # Instrumented runs bypass the cache so the parse is timed
+    cache_bytes = 0 if recorder is not None else None
+    with stage(recorder, 'read') as entry:
+        df_excel_orig = read_excel_cached(file_bytes, 'excel', max_bytes=cache_bytes)
+        df_pbi_orig = read_excel_cached(file_bytes, 'PBI', max_bytes=cache_bytes)
+        entry['rows'] = len(df_excel_orig) + len(df_pbi_orig)
+
+    common_columns = [col for col in df_excel_orig.columns if col in df_pbi_orig.columns]
+    if not common_columns:
+        return None, []
+
+    with stage(recorder, 'standardize', len(df_excel_orig) + len(df_pbi_orig)):
+        df_excel_std, df_pbi_std = standardize_column_data(df_excel_orig, df_pbi_orig, common_columns, max_workers, compact_dtypes)
+
+    with stage(recorder, 'write', len(df_excel_std) + len(df_pbi_std)):
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            write_standardized_sheet(writer, df_excel_std, 'excel')
+            write_standardized_sheet(writer, df_pbi_std, 'PBI')
+        output.seek(0)
+    return output, common_columns
+
 def run():
     # Custom CSS for styling
     st.markdown("""
@@ -96,6 +230,11 @@ def run():
         </div>
     """, unsafe_allow_html=True)
 
+    st.sidebar.header("⚡ Performance Options")
+    max_workers = st.sidebar.number_input("Column processes", min_value=1, max_value=os.cpu_count() or 1, value=1, step=1, key="std_max_workers_sidebar", help="Standardize columns in parallel worker processes. Worth it for wide sheets with many columns.")
+    compact_dtypes = st.sidebar.checkbox("Compact dtypes", value=False, key="std_compact_dtypes_sidebar", help="Keep dates as native datetimes and text as categoricals, stripped once per distinct value. Less memory on large sheets.")
+    record_stages, trace_memory = instrumentation_options("std")
+
     # File Upload
     st.markdown("### 📤 Upload Excel File")
     uploaded_file = st.file_uploader(
@@ -108,29 +247,14 @@ def run():
 
         with st.spinner("Standardizing your data... Please wait."):
             try:
-                xl = pd.ExcelFile(uploaded_file)
-                if 'excel' not in xl.sheet_names:
-                    raise ValueError("Sheet 'excel' not found in the uploaded file.")
-                if 'PBI' not in xl.sheet_names:
-                    raise ValueError("Sheet 'PBI' not found in the uploaded file.")
-                
-                df_excel_orig = xl.parse('excel')
-                df_pbi_orig = xl.parse('PBI')
-
-                common_columns = [col for col in df_excel_orig.columns if col in df_pbi_orig.columns]
+                # A missing 'excel' / 'PBI' sheet raises ValueError
+                recorder = StageRecorder('std', trace_memory, context={'file': uploaded_file.name, 'max_workers': int(max_workers), 'compact_dtypes': compact_dtypes}) if record_stages else None
+                output, common_columns = standardize_workbook(uploaded_file.getvalue(), int(max_workers), compact_dtypes, recorder)
 
                 if not common_columns:
                     st.warning("No common columns found between 'excel' and 'PBI' sheets.")
                 else:
                     st.markdown(f"**Common columns found:** ` {', '.join(common_columns)} `")
-                    
-                    df_excel_std, df_pbi_std = standardize_column_data(df_excel_orig, df_pbi_orig, common_columns)
-
-                    output = BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        df_excel_std.to_excel(writer, sheet_name='excel', index=False)
-                        df_pbi_std.to_excel(writer, sheet_name='PBI', index=False)
-                    output.seek(0)
 
                     original_name = os.path.splitext(uploaded_file.name)[0]
                     output_filename = f"{original_name}_standardized.xlsx" 
@@ -146,6 +270,7 @@ def run():
                         file_name=output_filename,
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                     )
+                    show_stage_timings(recorder, original_name)
 
             except ValueError as ve:
                 st.markdown(
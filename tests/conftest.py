@@ -0,0 +1,37 @@
+# conftest.py
+import datetime
+import os
+import sys
+
+import pytest
+
+# The tool modules live at the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from headless import quiet_streamlit_logging  # noqa: E402
+from helpers import workbook_bytes  # noqa: E402
+
+quiet_streamlit_logging()
+
+
+@pytest.fixture
+def gappy_workbook():
+    """'excel' and 'PBI' sheets with empty text, number and date cells."""
+    header = ["Region", "Store_ID", "Sales", "Opened"]
+    excel = [header,
+             ["north", 1, 10.5, datetime.datetime(2024, 1, 2)],
+             [None, 2, None, None],
+             ["South ", None, 3, datetime.datetime(2024, 3, 4)]]
+    pbi = [header,
+           ["NORTH", 1, 10.5, datetime.datetime(2024, 1, 2)],
+           [None, 2, 7, None],
+           ["east", 3, 1, datetime.datetime(2024, 5, 6)]]
+    return workbook_bytes({"excel": excel, "PBI": pbi})
+
+
+@pytest.fixture
+def sheet_cache_dir(tmp_path, monkeypatch):
+    """Points the Parquet sheet cache at an empty directory for the test."""
+    import cache
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+    return str(tmp_path)
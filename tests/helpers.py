@@ -0,0 +1,18 @@
+# helpers.py
+# Shared by the test modules; conftest.py only holds fixtures.
+import io
+
+from openpyxl import Workbook
+
+
+def workbook_bytes(sheets):
+    """xlsx bytes with one sheet per {name: [header, row, ...]} entry."""
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows:
+            ws.append(list(row))
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
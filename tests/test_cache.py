@@ -0,0 +1,47 @@
+# test_cache.py
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+import cache
+import readers
+import std
+
+
+def assert_same_cells(actual, expected):
+    pd.testing.assert_frame_equal(actual, expected)
+    # assert_frame_equal treats None and NaN alike; their text (what std writes) differs
+    pd.testing.assert_frame_equal(actual.astype(str), expected.astype(str))
+
+
+@pytest.mark.parametrize("backend", readers.available_backends())
+def test_cache_hit_matches_miss(gappy_workbook, sheet_cache_dir, backend):
+    for sheet_name in ("excel", "PBI"):
+        miss = cache.read_excel_cached(gappy_workbook, sheet_name, backend=backend)
+        hit = cache.read_excel_cached(gappy_workbook, sheet_name, backend=backend)
+        assert_same_cells(miss, readers.read_sheet(gappy_workbook, sheet_name, backend))
+        assert_same_cells(hit, miss)
+
+
+def test_concurrent_sessions_share_an_entry(gappy_workbook, sheet_cache_dir):
+    # Streamlit sessions are threads of one process, so they must not share a temp file
+    with ThreadPoolExecutor(8) as pool:
+        frames = list(pool.map(lambda _: cache.read_excel_cached(gappy_workbook, "excel"), range(16)))
+    for df in frames:
+        assert_same_cells(df, frames[0])
+    assert [name for name in os.listdir(sheet_cache_dir) if not name.endswith(".parquet")] == []
+    assert_same_cells(cache.read_excel_cached(gappy_workbook, "excel"), frames[0])
+
+
+def test_standardize_same_upload_twice(gappy_workbook, sheet_cache_dir):
+    # The first run parses the workbook, the second is served from the cache
+    runs = []
+    for _ in range(2):
+        output, _ = std.standardize_workbook(gappy_workbook)
+        wb = load_workbook(io.BytesIO(output.getvalue()))
+        runs.append({ws.title: list(ws.iter_rows(values_only=True)) for ws in wb.worksheets})
+    assert runs[1] == runs[0]
@@ -0,0 +1,123 @@
+# test_equivalence.py
+# The faster paths (codes keys, compact dtypes, hash partitions, streaming reads, the write-only
+# writer and the streaming merge) must produce the same output as the plain path.
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from headless import NamedBytesIO
+from helpers import workbook_bytes
+import mrg
+import val
+
+LOW, MID = 0.05, 0.5
+
+
+def sheet_rows(rng, n, regions):
+    rows = [["Region", "City", "Store_ID", "Sales", "Qty"]]
+    for _ in range(n):
+        rows.append([str(rng.choice(regions)), str(rng.choice(["x", "Y", "z ", "B-C"])), int(rng.integers(0, 20)),
+                     round(float(rng.uniform(0, 100)), 2), int(rng.integers(0, 10))])
+    return rows
+
+
+@pytest.fixture
+def validation_workbook(monkeypatch):
+    monkeypatch.setattr(val, "AGGREGATE_CACHE", val.OrderedDict())
+    rng = np.random.default_rng(7)
+    # 'EAST' and 'west ' only on one side each, so the report has keys missing from either sheet
+    return workbook_bytes({"excel": sheet_rows(rng, 600, ["north", "South ", "EAST", "A-B"]),
+                           "PBI": sheet_rows(rng, 500, ["NORTH", "south", "west ", "A-B"])})
+
+
+def cell_properties(source):
+    """{sheet: rows of (value, bold, fill colour, number format)} of xlsx bytes or a buffer."""
+    wb = load_workbook(io.BytesIO(source) if isinstance(source, bytes) else source)
+    sheets = {}
+    for ws in wb.worksheets:
+        sheets[ws.title] = [[(None if cell.value == "" else cell.value, cell.font.b,
+                              cell.fill.fgColor.rgb if cell.fill.fill_type else None, cell.number_format)
+                             for cell in row] for row in ws.iter_rows()]
+    return sheets
+
+
+@pytest.mark.parametrize("options", [
+    {"compact_dtypes": True},
+    {"max_workers": 2},
+    {"max_workers": 2, "key_mode": "codes"},
+    {"use_streaming": True},
+    {"use_streaming": True, "key_mode": "codes"},
+], ids=lambda options: "-".join(f"{key}={value}" for key, value in options.items()))
+def test_report_matches_serial_path(validation_workbook, options):
+    expected = val.compute_validation(validation_workbook, options.get("key_mode", "string"))
+    result = val.compute_validation(validation_workbook, **options)
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    pd.testing.assert_frame_equal(result[2], expected[2])
+    pd.testing.assert_frame_equal(result[3], expected[3])
+    pd.testing.assert_frame_equal(result[1], expected[1])
+
+
+def test_streaming_types_columns_like_the_whole_sheet(monkeypatch):
+    monkeypatch.setattr(val, "AGGREGATE_CACHE", val.OrderedDict())
+    header = ["Region", "Store_ID", "Sales", "Units", "City"]
+    rows = [[region, store, float(i), None if i < 4 else i % 3, 5 if i < 4 else "x"]
+            for i, (region, store) in enumerate(zip("ABAB" * 3, [0, 1, 2, 0, 1, 2, 0, 1, None, 2, 0, 1]))]
+    # Units is blank for the whole first chunk, Store_ID has its blank after it and City starts with numbers
+    workbook = workbook_bytes({"excel": [header] + rows, "PBI": [header] + rows[::-1]})
+    expected = val.compute_validation(workbook)[0]
+    result = val.generate_validation_report_chunked(val.read_sheet_chunks(io.BytesIO(workbook), "excel", chunk_rows=4),
+                                                    val.read_sheet_chunks(io.BytesIO(workbook), "PBI", chunk_rows=4))[0]
+    assert "Units_Diff" in result and "A-0.0-X" in set(result["unique_key"])
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_code_keys_match_string_keys(validation_workbook):
+    # Integer-coded keys list the rows in dimension order rather than unique_key order
+    expected = val.compute_validation(validation_workbook)[0]
+    result = val.compute_validation(validation_workbook, "codes")[0]
+    pd.testing.assert_frame_equal(result.iloc[:1], expected.iloc[:1])
+    pd.testing.assert_frame_equal(result.iloc[1:].sort_values("unique_key", ignore_index=True),
+                                  expected.iloc[1:].sort_values("unique_key", ignore_index=True))
+
+
+@pytest.mark.parametrize("excel_ids, pbi_ids, presence", [
+    ([1, 2, 3], ["1", "2", "3"], "Both: 3, Excel: 0, PBI: 0"),  # text IDs on one side still match
+    ([1.0, 2.0], [1, 2], "Both: 0, Excel: 2, PBI: 2"),  # '1.0' and '1' are different keys
+    ([1, "a", 2.0], [1.0, "A", True], "Both: 1, Excel: 2, PBI: 1"),  # groupby merges 1.0 and True
+])
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_code_keys_match_string_keys_across_dtypes(excel_ids, pbi_ids, presence, max_workers):
+    # Mixed lists become object columns, as read_excel gives them
+    excel = pd.DataFrame({"Region": "x", "Store_ID": excel_ids, "Sales": np.arange(1.0, len(excel_ids) + 1)})
+    pbi = pd.DataFrame({"Region": "x", "Store_ID": pbi_ids, "Sales": np.arange(1.0, len(pbi_ids) + 1)})
+    expected = val.generate_validation_report(excel.copy(), pbi.copy(), "string", max_workers=max_workers)[0]
+    result = val.generate_validation_report(excel.copy(), pbi.copy(), "codes", max_workers=max_workers)[0]
+    assert result["presence"][0] == expected["presence"][0] == presence
+    pd.testing.assert_frame_equal(result.iloc[1:].sort_values("unique_key", ignore_index=True),
+                                  expected.iloc[1:].sort_values("unique_key", ignore_index=True))
+
+
+@pytest.mark.parametrize("native_rules", [False, True])
+def test_streaming_writer_matches_writer(validation_workbook, native_rules):
+    report, checklist, diff_checker, top_mismatches = val.compute_validation(validation_workbook)
+    outputs = [val.build_report_workbook(report, checklist, diff_checker, "sample", LOW, MID, streaming_writer,
+                                         native_rules, top_mismatches)[0]
+               for streaming_writer in (False, True)]
+    assert cell_properties(outputs[1]) == cell_properties(outputs[0])
+
+
+def test_streaming_merge_matches_merge(validation_workbook):
+    report, checklist, diff_checker, top_mismatches = val.compute_validation(validation_workbook)
+    report_bytes = val.build_report_workbook(report, checklist, diff_checker, "page", LOW, MID, top_mismatches_df=top_mismatches)[0]
+    merged = []
+    for streaming, max_workers in ((False, 1), (True, 1), (True, 2)):
+        files = [NamedBytesIO(report_bytes, f"page{i}_validation_report.xlsx") for i in range(5)]
+        output, _, file_errors = mrg.combine_excel_files(files, LOW, MID, streaming=streaming, max_workers=max_workers)
+        assert file_errors == {}
+        merged.append(cell_properties(output))
+    assert list(merged[1]) == list(merged[0])
+    assert merged[1] == merged[0]
+    assert merged[2] == merged[0]
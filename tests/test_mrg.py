@@ -0,0 +1,33 @@
+# test_mrg.py
+from openpyxl import load_workbook
+
+from headless import NamedBytesIO
+from helpers import workbook_bytes
+import mrg
+
+
+def report_file(name):
+    rows = [["Region", "Sales: Diff"], ["north", 0.01], ["south", 0.2]]
+    return NamedBytesIO(workbook_bytes({"page_validation_report": rows}), name)
+
+
+def test_unreadable_report_is_returned_as_an_error():
+    files = [report_file("a.xlsx"), NamedBytesIO(b"garbage", "broken.xlsx"), report_file("b.xlsx")]
+    output, _, file_errors = mrg.combine_excel_files(files, 0.05, 0.5)
+    assert list(file_errors) == ["broken.xlsx"]
+    assert load_workbook(output).sheetnames == ["All_Pages_Summary", "page_validation_report", "page_validation_report_1"]
+
+
+def test_long_duplicate_sheet_names_keep_their_suffix():
+    counts, used = {}, set()
+    long_name = "a_very_long_page_validation_rep"  # already 31 characters
+    names = [mrg.unique_output_sheet_name(long_name, counts, used) for _ in range(120)]
+    assert len(set(names)) == 120
+    assert all(len(name) <= 31 for name in names)
+    assert names[:2] == [long_name, long_name[:29] + "_1"] and names[-1] == long_name[:27] + "_119"
+
+
+def test_clashing_sheet_names_get_a_counter():
+    counts, used = {}, set()
+    names = [mrg.unique_output_sheet_name(name, counts, used) for name in ["Page_1", "Page", "Page", "page"]]
+    assert names == ["Page_1", "Page", "Page_1(1)", "page(1)"]
@@ -0,0 +1,27 @@
+# test_std.py
+import datetime
+
+import pandas as pd
+
+import std
+
+
+def test_day_first_dates_are_not_swapped():
+    # 02/01/2024 is 2 January here; month-first parsing would read it as 1 February
+    values = pd.Series(["02/01/2024", "13/01/2024", "25/12/2023", "01/02/2024", None] * 20, dtype=object)
+    assert std.infer_date_format(std.sample_values(values)) == (True, "%d/%m/%Y")
+    dates, _ = std.standardize_column_pair(values, values)
+    assert dates.iloc[:4].tolist() == [datetime.date(2024, 1, 2), datetime.date(2024, 1, 13),
+                                       datetime.date(2023, 12, 25), datetime.date(2024, 2, 1)]
+
+
+def test_month_first_dates():
+    values = pd.Series(["02/01/2024", "12/13/2024", "12/25/2023"], dtype=object)
+    assert std.infer_date_format(std.sample_values(values)) == (True, "%m/%d/%Y")
+
+
+def test_text_no_single_format_fits_is_not_dates():
+    values = pd.Series(["02/01/2024", "2024-13-45", "hello", "n/a"], dtype=object)
+    assert std.infer_date_format(std.sample_values(values)) == (False, None)
+    text, _ = std.standardize_column_pair(values, values)
+    assert text.tolist() == values.tolist()
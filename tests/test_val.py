@@ -0,0 +1,63 @@
+# test_val.py
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import val
+from instrument import StageRecorder
+from mrg import read_report_metadata
+from readers import open_workbook
+
+
+def test_largest_positions_breaks_ties_by_position():
+    assert val.largest_positions(np.ones(1000), 5).tolist() == [0, 1, 2, 3, 4]
+    values = np.array([1.0, 3.0, 2.0, 3.0, 2.0, 2.0, 0.5])
+    assert val.largest_positions(values, 4).tolist() == [1, 3, 2, 4]
+    assert val.largest_positions(values, 10).tolist() == [1, 3, 2, 4, 5, 0, 6]
+
+
+def test_partitioned_fallback_is_not_nested_in_partition_stage():
+    frame = pd.DataFrame({"Sales": [1.0, 2.0], "Units": [3, 4]})  # no dimension columns
+    recorder = StageRecorder("val")
+    # The serial path it falls back to rejects sheets without dimensions
+    with pytest.raises(ValueError):
+        val.generate_validation_report_partitioned(frame.copy(), frame.copy(), max_workers=2, recorder=recorder)
+    assert [entry["stage"] for entry in recorder.stages] == ["aggregate"]
+    assert {"rss_start_mb", "rss_end_mb", "process_peak_rss_mb"} <= set(recorder.stages[0])
+
+
+def test_aggregate_cache_under_concurrent_sessions(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(val, "AGGREGATE_CACHE_MAX_ENTRIES", 2)
+    monkeypatch.setattr(val, "AGGREGATE_CACHE", val.OrderedDict())
+    frames = [pd.DataFrame({"Region": ["a", "b", "a"], "Sales": [1.0, 2.0, float(i)]}) for i in range(6)]
+
+    def aggregate(i):
+        agg, totals = val.aggregate_sheet_incremental(frames[i % 6], ["Region"], ["Sales"], val.normalise_text_columns)
+        return agg["Sales"].tolist(), totals["Sales"]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(aggregate, range(300)))
+    assert results[:6] == [([1.0 + i, 2.0], 3.0 + i) for i in range(6)]
+    assert results[6:] == results[:6] * 49
+    assert len(val.AGGREGATE_CACHE) == 2
+
+
+def test_instrumented_run_bypasses_caches(gappy_workbook, sheet_cache_dir, monkeypatch):
+    monkeypatch.setattr(val, "AGGREGATE_CACHE", val.OrderedDict())
+    recorder = StageRecorder("val")
+    val.compute_validation(gappy_workbook, recorder=recorder)
+    assert os.listdir(sheet_cache_dir) == [] and len(val.AGGREGATE_CACHE) == 0
+    assert [entry["stage"] for entry in recorder.stages][:5] == ["read", "normalise", "aggregate", "normalise", "aggregate"]
+
+
+def test_report_metadata_is_the_written_metadata():
+    report = pd.DataFrame({"unique_key": ["Avg Diff: 10.00%", "a", "b", "c"], "presence": [None, "Present in Both", "Present in Both", "Present in excel"],
+                           "Sales_excel": [None, 1.0, 2.0, 3.0], "Sales_PBI": [None, 1.0, 2.5, None], "Sales_Diff": [0.1, 0.0, 0.2, None]})
+    checklist = pd.DataFrame({"Column": ["Sales"], "Match": ["Yes"]})
+    output, metadata = val.build_report_workbook(report, checklist, pd.DataFrame(), "sample", 0.05, 0.5, exceptions_only=True)
+    assert read_report_metadata(open_workbook(output)) == metadata
+    assert metadata["report_rows"] == 3 and any(key.startswith("suppressed") for key in metadata)
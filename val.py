@@ -1,11 +1,24 @@
 import streamlit as st
 import pandas as pd
+import copy
+import datetime
+import hashlib
 import io
+import itertools
 import numpy as np
 import os
-from openpyxl.styles import PatternFill, Font
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from openpyxl import Workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
+from openpyxl.formatting.rule import ColorScaleRule, FormulaRule
 from openpyxl.utils import get_column_letter
 import base64  # For base64 image encoding
+from cache import read_excel_cached
+from readers import open_workbook
+from instrument import StageRecorder, instrumentation_options, show_stage_timings, stage
 
 # Define the checklist data as a DataFrame (assuming it's used or defined elsewhere if not directly in run)
 checklist_data = {
@@ -22,98 +35,204 @@ checklist_data = {
 }
 checklist_df = pd.DataFrame(checklist_data)
 
+PRESENCE_LABELS = {
+    'both': 'Present in Both',
+    'left_only': 'Present in excel',
+    'right_only': 'Present in PBI',
+}
 
-# --- generate_validation_report function (includes "Summary Avg Diff: X.XX%" modification) ---
-def generate_validation_report(excel_df, pbi_df):
-    dims = [col for col in excel_df.columns if col in pbi_df.columns and
-            (excel_df[col].dtype == 'object' or '_id' in col.lower() or '_key' in col.lower() or
-             '_ID' in col or '_KEY' in col)]
 
-    excel_df[dims] = excel_df[dims].fillna('NAN')
-    pbi_df[dims] = pbi_df[dims].fillna('NAN')
+def build_unique_key(agg_df, dims):
+    # Column-wise concatenation instead of a row-wise '-'.join over every row
+    if not dims:
+        return pd.Series('', index=agg_df.index)
+    key = agg_df[dims[0]].astype(str)
+    for dim in dims[1:]:
+        key = key + '-' + agg_df[dim].astype(str)
+    return key.str.upper()
+
+
+def dimension_key_text(column):
+    """
+    (codes, texts): texts[codes[i]] is the upper-cased text build_unique_key writes for column[i].
+    Typed columns are converted once per distinct value. Object columns are converted per row,
+    since factorize treats 1, 1.0 and True as one value while their texts differ.
+    """
+    if column.dtype == object:
+        column = column.astype(str)
+    codes, uniques = pd.factorize(column, use_na_sentinel=False)
+    return codes, pd.Series(uniques).astype(str).str.upper()
+
+
+def encode_dimension_keys(excel_agg, pbi_agg, dims):
+    """
+    Factorizes the dimension tuples of both aggregated sides into one shared set of int64 codes.
+    Values match when their unique_key text matches, as in the string key mode; tuples are
+    compared per dimension, so no separator can make two keys collide.
+    """
+    n_excel = len(excel_agg)
+    combined = np.zeros(n_excel + len(pbi_agg), dtype=np.int64)
+    for dim in dims:
+        excel_codes, excel_texts = dimension_key_text(excel_agg[dim])
+        pbi_codes, pbi_texts = dimension_key_text(pbi_agg[dim])
+        text_codes, text_uniques = pd.factorize(pd.concat([excel_texts, pbi_texts], ignore_index=True))
+        dim_codes = np.concatenate([text_codes[:len(excel_texts)][excel_codes], text_codes[len(excel_texts):][pbi_codes]])
+        # Re-factorize after folding in each dimension so the codes stay dense and never overflow
+        combined, _ = pd.factorize(combined * len(text_uniques) + dim_codes)
+    return combined[:n_excel], combined[n_excel:]
+
+
+def compare_aggregates(excel_agg, pbi_agg, dims, all_measures, key_col='unique_key'):
+    """
+    Matches the aggregated sides with a single outer hash join on key_col and
+    returns the data rows of the report (presence, side-by-side measures and _Diff).
+    When joining on integer key codes, unique_key is only built for the joined rows.
+    """
+    # Keys that collide after upper-casing keep the last group, as the old dict lookups did
+    excel_side = excel_agg.drop_duplicates(key_col, keep='last')
+    pbi_side = pbi_agg.drop_duplicates(key_col, keep='last')
+
+    excel_side = excel_side[[key_col] + dims + all_measures].rename(
+        columns={measure: f'{measure}_excel' for measure in all_measures})
+    pbi_side = pbi_side[[key_col] + dims + all_measures].rename(
+        columns={dim: f'{dim}__pbi' for dim in dims} | {measure: f'{measure}_PBI' for measure in all_measures})
+
+    merged = excel_side.merge(pbi_side, on=key_col, how='outer', sort=False, indicator=True)
+    from_excel = (merged['_merge'] != 'right_only').to_numpy()
+
+    data_rows_df = pd.DataFrame(index=merged.index)
+    if key_col == 'unique_key':
+        data_rows_df['unique_key'] = merged['unique_key']
+    else:
+        # Build the readable key from each side's own (un-upcast) dimension values
+        unique_key = np.empty(len(merged), dtype=object)
+        pbi_dim_names = {f'{dim}__pbi': dim for dim in dims}
+        for side_mask, side_df in ((from_excel, excel_side), (~from_excel, pbi_side.rename(columns=pbi_dim_names))):
+            if side_mask.any():
+                side_rows = side_df.set_index(key_col).loc[merged.loc[side_mask, key_col]]
+                unique_key[side_mask] = build_unique_key(side_rows, dims).to_numpy()
+        data_rows_df['unique_key'] = unique_key
 
-    excel_measures = [col for col in excel_df.columns if col not in dims and np.issubdtype(excel_df[col].dtype, np.number)]
-    pbi_measures = [col for col in pbi_df.columns if col not in dims and np.issubdtype(pbi_df[col].dtype, np.number)]
+    for dim in dims:
+        # Dimension values come from excel first, PBI fills the keys only PBI has
+        data_rows_df[dim] = merged[dim].where(from_excel, merged[f'{dim}__pbi'])
 
-    all_measures = list(set(excel_measures) & set(pbi_measures))
+    data_rows_df['presence'] = merged['_merge'].map(PRESENCE_LABELS).astype(object)
 
-    excel_agg = excel_df.groupby(dims, observed=False)[all_measures].sum().reset_index()
-    pbi_agg = pbi_df.groupby(dims, observed=False)[all_measures].sum().reset_index()
+    for measure in all_measures:
+        data_rows_df[f'{measure}_excel'] = merged[f'{measure}_excel']
+        data_rows_df[f'{measure}_PBI'] = merged[f'{measure}_PBI']
 
+        excel_vals = data_rows_df[f'{measure}_excel'].fillna(0).to_numpy(dtype=float)
+        pbi_vals = data_rows_df[f'{measure}_PBI'].fillna(0).to_numpy(dtype=float)
 
-    excel_agg['unique_key'] = excel_agg[dims].astype(str).agg('-'.join, axis=1).str.upper()
-    pbi_agg['unique_key'] = pbi_agg[dims].astype(str).agg('-'.join, axis=1).str.upper()
+        # Relative diff per key: |PBI - excel| / excel, 100% when only excel is zero
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diff_values = np.where(
+                (excel_vals == 0) & (pbi_vals == 0), 0,
+                np.where(excel_vals == 0, 1, np.abs((pbi_vals - excel_vals) / excel_vals))
+            )
+        data_rows_df[f'{measure}_Diff'] = np.round(diff_values, 4)
 
-    excel_agg = excel_agg[['unique_key'] + [col for col in excel_agg.columns if col != 'unique_key']]
-    pbi_agg = pbi_agg[['unique_key'] + [col for col in pbi_agg.columns if col != 'unique_key']]
+    return data_rows_df.reset_index(drop=True)
 
-    # Create a DataFrame for rows that are not the summary
-    unique_keys_data = list(set(excel_agg['unique_key']) | set(pbi_agg['unique_key']))
-    if not unique_keys_data: # Handle case with no common keys or data after filtering
-        # If there are no data rows, we still might want to show a summary (e.g., of total sums)
-        # For now, we'll proceed, and it might result in an empty data section below summary.
-        # Or, decide on specific behavior for fully empty data.
-         pass
 
-    data_rows_df = pd.DataFrame({'unique_key': unique_keys_data})
+def is_text_column(series):
+    # Text columns are object dtype, or categorical in compact-dtype mode
+    return series.dtype == 'object' or isinstance(series.dtype, pd.CategoricalDtype)
 
 
-    for dim in dims:
-        # Map from excel_agg first
-        map_excel = dict(zip(excel_agg['unique_key'], excel_agg[dim]))
-        data_rows_df[dim] = data_rows_df['unique_key'].map(map_excel)
-        # Fill NaNs with values from pbi_agg for the same dimension
-        map_pbi = dict(zip(pbi_agg['unique_key'], pbi_agg[dim]))
-        data_rows_df[dim].fillna(data_rows_df['unique_key'].map(map_pbi), inplace=True)
+def is_numeric_column(series):
+    return not isinstance(series.dtype, pd.CategoricalDtype) and np.issubdtype(series.dtype, np.number)
 
 
-    data_rows_df['presence'] = data_rows_df['unique_key'].apply(
-        lambda key: 'Present in Both' if key in excel_agg['unique_key'].values and key in pbi_agg['unique_key'].values
-        else ('Present in excel' if key in excel_agg['unique_key'].values
-              else 'Present in PBI')
-    )
+def detect_dims_and_measures(excel_df, pbi_df):
+    dims = [col for col in excel_df.columns if col in pbi_df.columns and
+            (is_text_column(excel_df[col]) or '_id' in col.lower() or '_key' in col.lower() or
+             '_ID' in col or '_KEY' in col)]
+
+    excel_measures = [col for col in excel_df.columns if col not in dims and is_numeric_column(excel_df[col])]
+    pbi_measures = [col for col in pbi_df.columns if col not in dims and is_numeric_column(pbi_df[col])]
+
+    # Keep the excel column order so the report layout is stable between runs
+    all_measures = [col for col in excel_measures if col in pbi_measures]
+    return dims, all_measures
 
-    for measure in all_measures:
-        data_rows_df[f'{measure}_excel'] = data_rows_df['unique_key'].map(dict(zip(excel_agg['unique_key'], excel_agg[measure])))
-        data_rows_df[f'{measure}_PBI'] = data_rows_df['unique_key'].map(dict(zip(pbi_agg['unique_key'], pbi_agg[measure])))
-
-        # Calculate Diff for data rows
-        excel_vals = data_rows_df[f'{measure}_excel'].fillna(0)
-        pbi_vals = data_rows_df[f'{measure}_PBI'].fillna(0)
-
-        # Diff calculation logic for data rows (sum of measures for a given unique_key combination)
-        # This diff is absolute difference of sums.
-        # If you need percentage diff for each row: (pbi_val - excel_val) / excel_val
-        # The current code calculates absolute difference.
-        # The request implies the _Diff column for summary is a percentage, but for data rows it's also a percentage of row-level sums.
-        # Let's assume the original _Diff for data rows was also intended as a relative percentage difference.
-        # (PBI_sum_for_key - Excel_sum_for_key) / Excel_sum_for_key
-
-        diff_values = np.where(
-            (excel_vals == 0) & (pbi_vals == 0), 0, # Both zero, diff is 0
-            np.where(excel_vals == 0, 1, # Excel is zero, PBI is not, 100% diff (or -1 if PBI is negative)
-                     abs((pbi_vals - excel_vals) / excel_vals) # Standard percentage diff
-            )
-        )
-        data_rows_df[f'{measure}_Diff'] = np.round(diff_values, 4)
 
+def aggregate_side(df, dims, all_measures):
+    """Returns (per-key sums of the measures, overall sum of each measure) for one side."""
+    fill_missing_dims(df, dims)
 
+    # observed=True so categorical dims only group the combinations that occur
+    agg = df.groupby(dims, observed=True)[all_measures].sum().reset_index()
+    # One row per key is small; the report is built from plain object columns
+    for dim in dims:
+        if isinstance(agg[dim].dtype, pd.CategoricalDtype):
+            agg[dim] = agg[dim].astype(object)
+
+    # Overall sums from the original frame for the summary row
+    totals = {measure: df[measure].sum() for measure in all_measures}
+    return agg, totals
+
+
+# --- generate_validation_report function (includes "Summary Avg Diff: X.XX%" modification) ---
+def generate_validation_report(excel_df, pbi_df, key_mode='string', recorder=None, max_workers=1):
+    # key_mode='codes' joins on shared integer codes of the dimension tuples instead of
+    # the '-'-joined unique_key, which is then only built for the rows of the report.
+    # max_workers > 1 aggregates and matches hash partitions of the keys in worker processes
+    if max_workers > 1:
+        return generate_validation_report_partitioned(excel_df, pbi_df, key_mode, max_workers, recorder)
+    with stage(recorder, 'aggregate', len(excel_df) + len(pbi_df)):
+        dims, all_measures = detect_dims_and_measures(excel_df, pbi_df)
+        excel_agg, excel_totals = aggregate_side(excel_df, dims, all_measures)
+        pbi_agg, pbi_totals = aggregate_side(pbi_df, dims, all_measures)
+
+    with stage(recorder, 'key_matching', len(excel_agg) + len(pbi_agg)):
+        return build_validation_report(excel_agg, pbi_agg, dims, all_measures, excel_totals, pbi_totals, key_mode=key_mode)
+
+
+def build_validation_report(excel_agg, pbi_agg, dims, all_measures, excel_totals, pbi_totals, key_mode='string'):
+    """
+    Builds the report (summary row + data rows) from the per-key aggregates of both sides.
+    excel_totals / pbi_totals hold the overall sum of each measure for the summary row.
+    """
+    excel_agg, pbi_agg, key_col = add_report_keys(excel_agg, pbi_agg, dims, key_mode)
+    data_rows_df = compare_aggregates(excel_agg, pbi_agg, dims, all_measures, key_col=key_col)
+    return assemble_report(data_rows_df, dims, all_measures, excel_totals, pbi_totals), excel_agg, pbi_agg
+
+
+def add_report_keys(excel_agg, pbi_agg, dims, key_mode='string'):
+    """Adds the join key column (first) to both aggregates; returns (excel_agg, pbi_agg, key_col)."""
+    key_col = 'key_code' if key_mode == 'codes' else 'unique_key'
+    if key_mode == 'codes':
+        excel_agg['key_code'], pbi_agg['key_code'] = encode_dimension_keys(excel_agg, pbi_agg, dims)
+    else:
+        excel_agg['unique_key'] = build_unique_key(excel_agg, dims)
+        pbi_agg['unique_key'] = build_unique_key(pbi_agg, dims)
+
+    excel_agg = excel_agg[[key_col] + [col for col in excel_agg.columns if col != key_col]]
+    pbi_agg = pbi_agg[[key_col] + [col for col in pbi_agg.columns if col != key_col]]
+    return excel_agg, pbi_agg, key_col
+
+
+def assemble_report(data_rows_df, dims, all_measures, excel_totals, pbi_totals):
+    """Puts the summary row (overall diffs and presence counts) on top of the data rows."""
     # Summary Row Calculation
     summary_row_data = {'unique_key': 'Summary'} # Placeholder
     for dim in dims:
         summary_row_data[dim] = ''
     summary_row_data['presence'] = '' # Placeholder for presence summary string
     for measure in all_measures:
-        summary_row_data[f'{measure}_excel'] = excel_df[measure].sum() # Overall sum from original excel_df
-        summary_row_data[f'{measure}_PBI'] = pbi_df[measure].sum()     # Overall sum from original pbi_df
+        summary_row_data[f'{measure}_excel'] = excel_totals[measure] # Overall sum from original excel_df
+        summary_row_data[f'{measure}_PBI'] = pbi_totals[measure]     # Overall sum from original pbi_df
         summary_row_data[f'{measure}_Diff'] = '' # Placeholder for overall diff percentage
 
     summary_row = pd.Series(summary_row_data)
 
     diff_percentages_for_average = []
     for measure in all_measures:
-        excel_total_sum = excel_df[measure].sum()
-        pbi_total_sum = pbi_df[measure].sum()
+        excel_total_sum = excel_totals[measure]
+        pbi_total_sum = pbi_totals[measure]
         diff_percentage = 0
         if excel_total_sum != 0:
             diff_percentage = abs(round((pbi_total_sum - excel_total_sum) / excel_total_sum, 4))
@@ -147,7 +266,295 @@ def generate_validation_report(excel_df, pbi_df):
     final_validation_report = pd.concat([summary_df, data_rows_df], ignore_index=True)
     final_validation_report = final_validation_report[column_order] # Ensure final column order
 
-    return final_validation_report, excel_agg, pbi_agg
+    return final_validation_report
+
+
+# --- Hash-partitioned (multi-process) aggregation and matching ---
+# Both sides are split by a hash of the dimension tuple, so every key is aggregated and matched
+# entirely inside one partition. Partitions run in worker processes and the partial reports are
+# put back in the order the serial path produces.
+PARTITION_HASH_MULTIPLIER = np.uint64(1000003)
+
+
+def partition_ids(df, dims, n_partitions):
+    """
+    Partition number of every row, from a hash of the unique_key text of its dimension values
+    (hashed once per distinct value). Values groupby would merge (1 and 1.0 in an object column)
+    share the text of the first one, so a group is never split; keys that still match across
+    partitions are caught in generate_validation_report_partitioned.
+    """
+    combined = np.zeros(len(df), dtype=np.uint64)
+    for dim in dims:
+        codes, uniques = pd.factorize(df[dim], use_na_sentinel=False)
+        texts = pd.Series(uniques).astype(str).str.upper()
+        unique_hashes = pd.util.hash_pandas_object(texts, index=False).to_numpy()
+        combined = combined * PARTITION_HASH_MULTIPLIER + unique_hashes[codes]
+    return (combined % np.uint64(n_partitions)).astype(np.int64)
+
+
+def split_partitions(df, dims, n_partitions):
+    """n_partitions frames; rows keep their original relative order within each partition."""
+    ids = partition_ids(df, dims, n_partitions)
+    order = np.argsort(ids, kind='stable')
+    bounds = np.searchsorted(ids[order], np.arange(1, n_partitions))
+    return [df.iloc[rows] for rows in np.split(order, bounds)]
+
+
+def compare_partition(excel_part, pbi_part, dims, all_measures, key_mode='string'):
+    """Worker: aggregates and matches one partition; returns (data rows, excel_agg, pbi_agg)."""
+    excel_agg, _ = aggregate_side(excel_part, dims, all_measures)
+    pbi_agg, _ = aggregate_side(pbi_part, dims, all_measures)
+    excel_agg, pbi_agg, key_col = add_report_keys(excel_agg, pbi_agg, dims, key_mode)
+    return compare_aggregates(excel_agg, pbi_agg, dims, all_measures, key_col=key_col), excel_agg, pbi_agg
+
+
+def group_order(df, dims):
+    """Positions that put df in the order groupby(dims, sort=True) emits its keys."""
+    return np.lexsort([pd.factorize(df[dim], sort=True)[0] for dim in reversed(dims)])
+
+
+def generate_validation_report_partitioned(excel_df, pbi_df, key_mode='string', max_workers=2, recorder=None):
+    """
+    generate_validation_report with the groupby and key matching spread over max_workers processes.
+    Falls back to the serial path when a key would match across partitions (e.g. two dimension
+    tuples that '-'-join to the same unique_key), so the output is always the serial output.
+    """
+    dims, all_measures = detect_dims_and_measures(excel_df, pbi_df)
+    if not dims:
+        return generate_validation_report(excel_df, pbi_df, key_mode, recorder)
+    with stage(recorder, 'partition', len(excel_df) + len(pbi_df)):
+        fill_missing_dims(excel_df, dims)
+        fill_missing_dims(pbi_df, dims)
+        # Totals over the full columns rather than summed partition totals, which could differ
+        # from the serial sums in the last bits
+        excel_totals = {measure: excel_df[measure].sum() for measure in all_measures}
+        pbi_totals = {measure: pbi_df[measure].sum() for measure in all_measures}
+        excel_parts = split_partitions(excel_df[dims + all_measures], dims, max_workers)
+        pbi_parts = split_partitions(pbi_df[dims + all_measures], dims, max_workers)
+
+    with stage(recorder, 'aggregate_and_match', len(excel_df) + len(pbi_df)):
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            partials = list(executor.map(compare_partition, excel_parts, pbi_parts,
+                                         itertools.repeat(dims), itertools.repeat(all_measures), itertools.repeat(key_mode)))
+
+    with stage(recorder, 'combine_partitions') as entry:
+        data_rows_df = pd.concat([partial[0] for partial in partials], ignore_index=True)
+        entry['rows'] = len(data_rows_df)
+        excel_agg = pd.concat([partial[1] for partial in partials], ignore_index=True)
+        pbi_agg = pd.concat([partial[2] for partial in partials], ignore_index=True)
+        if key_mode == 'codes':
+            # Each data row is one key of its partition; fewer keys overall means one matched across partitions
+            excel_codes, pbi_codes = encode_dimension_keys(excel_agg, pbi_agg, dims)
+            crossed = len(np.unique(np.concatenate([excel_codes, pbi_codes]))) != len(data_rows_df)
+        else:
+            crossed = data_rows_df['unique_key'].duplicated().any()
+        if not crossed:
+            excel_agg = excel_agg.iloc[group_order(excel_agg, dims)].reset_index(drop=True)
+            pbi_agg = pbi_agg.iloc[group_order(pbi_agg, dims)].reset_index(drop=True)
+
+            # The outer join sorts on its key: unique_key strings, or key codes numbered in
+            # excel group order followed by the PBI-only keys in PBI group order
+            if key_mode == 'codes':
+                excel_agg, pbi_agg, _ = add_report_keys(excel_agg.drop(columns='key_code'), pbi_agg.drop(columns='key_code'), dims, key_mode)
+                pbi_only = data_rows_df['presence'].eq(PRESENCE_LABELS['right_only']).to_numpy()
+                excel_rows = data_rows_df[~pbi_only]
+                pbi_rows = data_rows_df[pbi_only]
+                data_rows_df = pd.concat([excel_rows.iloc[group_order(excel_rows, dims)],
+                                          pbi_rows.iloc[group_order(pbi_rows, dims)]], ignore_index=True)
+            else:
+                data_rows_df = data_rows_df.sort_values('unique_key', kind='stable', ignore_index=True)
+            validation_report = assemble_report(data_rows_df, dims, all_measures, excel_totals, pbi_totals)
+
+    if crossed:
+        return generate_validation_report(excel_df, pbi_df, key_mode, recorder)
+    return validation_report, excel_agg, pbi_agg
+
+# --- Streaming (chunked) ingestion for very large sheets ---
+STREAMING_CHUNK_ROWS = 50000
+
+
+def normalise_text_columns(df):
+    return df.apply(lambda x: x.str.upper().str.strip() if x.dtype == "object" else x)
+
+
+def compact_text_columns(df):
+    """
+    Compact-dtype variant of normalise_text_columns: each object column is upper-cased and
+    stripped once per distinct value and stored as a categorical with sorted categories, so
+    groupby sees small integer codes and the key order matches the object-dtype path.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype != 'object':
+            continue
+        codes, uniques = pd.factorize(df[col])
+        normalised = pd.Series(uniques, dtype=object).str.upper().str.strip()
+        # Distinct values can collide after normalising ('a ' and 'A'); re-factorize the results
+        normalised_codes, categories = pd.factorize(normalised, sort=True)
+        row_codes = np.where(codes >= 0, normalised_codes[codes], -1) if len(uniques) else codes
+        df[col] = pd.Categorical.from_codes(row_codes, categories=categories)
+    return df
+
+
+def fill_missing_dims(df, dims):
+    """fillna('NAN') on the dimension columns, keeping categorical dims categorical."""
+    for dim in dims:
+        column = df[dim]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            if column.isna().any():
+                categories = sorted(set(column.cat.categories) | {'NAN'})
+                df[dim] = column.cat.set_categories(categories).fillna('NAN')
+        elif column.isna().any():
+            df[dim] = column.fillna('NAN')
+
+
+def read_sheet_columns(workbook_source, sheet_name, backend='openpyxl'):
+    wb = open_workbook(workbook_source, backend)
+    try:
+        header = next(iter(wb.iter_rows(sheet_name)), ())
+    finally:
+        wb.close()
+    return [f'Unnamed: {idx}' if value is None else value for idx, value in enumerate(header)]
+
+
+def read_sheet_chunks(workbook_source, sheet_name, chunk_rows=STREAMING_CHUNK_ROWS, backend='openpyxl'):
+    """
+    Yields the rows of a sheet as normalised DataFrames of at most chunk_rows rows.
+    The first chunk is always yielded (possibly empty) so callers can see the columns.
+    Defaults to openpyxl, whose read-only mode streams rows; calamine loads the whole sheet.
+    """
+    wb = open_workbook(workbook_source, backend)
+    try:
+        rows = wb.iter_rows(sheet_name)
+        header = next(rows, ())
+        columns = [f'Unnamed: {idx}' if value is None else value for idx, value in enumerate(header)]
+        first = True
+        while True:
+            chunk = [row[:len(columns)] for row in itertools.islice(rows, chunk_rows)]
+            if not chunk and not first:
+                break
+            first = False
+            yield normalise_text_columns(pd.DataFrame(chunk, columns=columns))
+    finally:
+        wb.close()
+
+
+def column_kind(column):
+    """'text', 'number' or 'other': how read_excel would type a column holding these values."""
+    if column.dtype == 'object':
+        return 'text'
+    return 'number' if is_numeric_column(column) else 'other'
+
+
+def kinds_template(columns, kinds, blank_kind):
+    """
+    Empty frame whose dtypes stand in for the sheet's columns, so detect_dims_and_measures can decide
+    the roles. Columns without values so far count as blank_kind.
+    """
+    dtypes = {'text': object, 'number': 'float64', 'other': 'bool'}
+    return pd.DataFrame({col: pd.Series(dtype=dtypes[kinds.get(col, blank_kind)]) for col in columns})
+
+
+def fold_partials(frames, dims, measures):
+    # Dims that were only decided in a later chunk are missing from earlier partials: those rows were blank
+    combined = pd.concat(frames, ignore_index=True).reindex(columns=dims + measures)
+    combined[dims] = combined[dims].fillna('NAN')
+    return combined.groupby(dims, observed=True)[measures].sum().reset_index()
+
+
+def aggregate_chunks(chunks, choose_columns):
+    """
+    Folds chunks into running per-key sums of the measures, so memory grows with the
+    number of distinct keys rather than the number of rows read.
+    Each column's kind is taken from the first chunk where it has values, and becomes 'text' as soon
+    as a chunk holds text in it; choose_columns(kinds, final) returns the (dims, measures) for the
+    kinds seen so far. A column that is still blank has no role yet: its earlier rows become 'NAN'
+    if it turns out to be a dimension and add nothing if it is a measure. The earlier rows of a
+    column that turns to text are dropped the same way, since the full sheet's text normalisation
+    makes its numbers NaN. Returns (aggregate, kinds).
+    """
+    kinds = {}
+    float_columns = set()  # Blank or fractional cells make read_excel type a numeric column float64
+    partials = []
+    partial_rows = 0
+    running = None
+    for chunk in chunks:
+        for col in chunk.columns:
+            has_blanks = chunk[col].isna()
+            if has_blanks.all() or kinds.get(col) == 'text':
+                pass
+            elif col not in kinds:
+                kinds[col] = column_kind(chunk[col])
+            elif column_kind(chunk[col]) == 'text':
+                kinds[col] = 'text'
+                partials = [partial.drop(columns=col, errors='ignore') for partial in partials]
+                if running is not None:
+                    running = running.drop(columns=col, errors='ignore')
+            if has_blanks.any() or chunk[col].dtype.kind == 'f':
+                float_columns.add(col)
+        dims, measures = choose_columns(kinds, False)
+        for dim in dims:
+            # A text column without text in this chunk is normalised the way the full sheet would be:
+            # str.upper() makes every non-text value NaN
+            if kinds.get(dim) == 'text' and chunk[dim].dtype != 'object':
+                chunk[dim] = np.nan
+        chunk[dims] = chunk[dims].fillna('NAN')
+        for measure in measures:
+            chunk[measure] = pd.to_numeric(chunk[measure], errors='coerce')
+        partial = chunk.groupby(dims, observed=True)[measures].sum().reset_index()
+        partials.append(partial)
+        partial_rows += len(partial)
+
+        running_rows = 0 if running is None else len(running)
+        if partial_rows > max(STREAMING_CHUNK_ROWS, running_rows):
+            running = fold_partials(([running] if running is not None else []) + partials, dims, measures)
+            partials, partial_rows = [], 0
+
+    dims, measures = choose_columns(kinds, True)
+    running = fold_partials(([running] if running is not None else []) + partials, dims, measures)
+    for dim in dims:
+        if kinds.get(dim) == 'number' and dim in float_columns:
+            # Keys of whole-number chunks were ints; the full column would have been float64
+            running[dim] = running[dim].map(lambda value: float(value) if isinstance(value, (int, np.integer)) else value)
+    return running, kinds
+
+
+def generate_validation_report_chunked(excel_chunks, pbi_chunks, key_mode='string', recorder=None):
+    """
+    Streaming variant of generate_validation_report over iterators of normalised chunks
+    (see read_sheet_chunks). Column roles follow detect_dims_and_measures on the dtype read_excel
+    would give each whole column (see aggregate_chunks).
+    """
+    # Reading and aggregating are interleaved, so they are recorded as one stage
+    with stage(recorder, 'read_and_aggregate'):
+        excel_head = next(excel_chunks)
+        pbi_head = next(pbi_chunks)
+        excel_columns, pbi_columns = list(excel_head.columns), list(pbi_head.columns)
+
+        def excel_roles(kinds, final):
+            # The PBI kinds are not known yet: every common column may still be a measure
+            return detect_dims_and_measures(kinds_template(excel_columns, kinds, 'number' if final else 'other'),
+                                            kinds_template(pbi_columns, {}, 'number'))
+
+        excel_agg, excel_kinds = aggregate_chunks(itertools.chain([excel_head], excel_chunks), excel_roles)
+        dims, excel_measures = excel_roles(excel_kinds, True)
+
+        def pbi_roles(kinds, final):
+            pbi_template = kinds_template(pbi_columns, kinds, 'number' if final else 'other')
+            return dims, [measure for measure in excel_measures if is_numeric_column(pbi_template[measure]) or measure not in kinds]
+
+        pbi_agg, pbi_kinds = aggregate_chunks(itertools.chain([pbi_head], pbi_chunks), pbi_roles)
+        all_measures = detect_dims_and_measures(kinds_template(excel_columns, excel_kinds, 'number'),
+                                                kinds_template(pbi_columns, pbi_kinds, 'number'))[1]
+        excel_agg = excel_agg[dims + all_measures]
+        pbi_agg = pbi_agg[dims + all_measures]
+
+        excel_totals = {measure: excel_agg[measure].sum() for measure in all_measures}
+        pbi_totals = {measure: pbi_agg[measure].sum() for measure in all_measures}
+
+    with stage(recorder, 'key_matching', len(excel_agg) + len(pbi_agg)):
+        return build_validation_report(excel_agg, pbi_agg, dims, all_measures, excel_totals, pbi_totals, key_mode=key_mode)
+
 
 # --- column_checklist function ---
 def column_checklist(excel_df, pbi_df):
@@ -184,26 +591,15 @@ def generate_diff_checker(validation_report): # validation_report here is the fi
             diff_checker_data.append({'Diff Column Name': col, 'Percentage Difference': str(value)})
 
     diff_checker = pd.DataFrame(diff_checker_data)
-    presence_value_summary_row = summary_row_values['presence']
-
-    try:
-        # Parse the "Both: X, Excel: Y, PBI: Z" string
-        parts = presence_value_summary_row.split(',')
-        both_count_str = parts[0].split(':')[1].strip()
-        excel_count_str = parts[1].split(':')[1].strip()
-        # pbi_count_str = parts[2].split(':')[1].strip() # If needed
-
-        both_count = int(both_count_str)
-        excel_only_count = int(excel_count_str)
-
-        total_for_presence_metric = both_count + excel_only_count
-        presence_percentage_metric = (both_count / total_for_presence_metric * 100) if total_for_presence_metric > 0 else 0
-        # Refined presence summary text
-        presence_summary_text = f"{presence_percentage_metric:.2f}% ({both_count} Both / {total_for_presence_metric} Total (Both+ExcelOnly))"
-
-    except Exception: # Fallback if parsing fails
-        presence_summary_text = presence_value_summary_row if pd.notna(presence_value_summary_row) else 'N/A'
+    # Counts come straight from the presence column rather than the summary row's text
+    counts = presence_counts(validation_report)
+    both_count = counts['both']
+    excel_only_count = counts['excel_only']
 
+    total_for_presence_metric = both_count + excel_only_count
+    presence_percentage_metric = (both_count / total_for_presence_metric * 100) if total_for_presence_metric > 0 else 0
+    # Refined presence summary text
+    presence_summary_text = f"{presence_percentage_metric:.2f}% ({both_count} Both / {total_for_presence_metric} Total (Both+ExcelOnly))"
 
     presence_summary_df = pd.DataFrame([{
         'Diff Column Name': 'Row Presence (Both / (Both + Excel Only))',
@@ -213,6 +609,796 @@ def generate_diff_checker(validation_report): # validation_report here is the fi
     return diff_checker
 
 
+# --- Machine-readable report metadata ---
+# Each report carries a hidden Report_Metadata sheet of Key / Value rows, so the merger (and other
+# tools) can read the per-measure diffs, presence counts, row counts and thresholds directly instead
+# of parsing "Avg Diff: X.XX%" or "Both: X, Excel: Y, PBI: Z" back out of the report.
+REPORT_METADATA_SHEET = "Report_Metadata"
+REPORT_METADATA_VERSION = 1
+
+
+def presence_counts(validation_report):
+    presence = validation_report['presence'].iloc[1:] # Skip the summary row
+    return {
+        'both': int(presence.eq('Present in Both').sum()),
+        'excel_only': int(presence.eq('Present in excel').sum()),
+        'pbi_only': int(presence.eq('Present in PBI').sum()),
+    }
+
+
+def build_report_metadata(validation_report, report_sheet_name, low_threshold, mid_threshold):
+    summary_row_values = validation_report.iloc[0]
+    measure_diffs = {}
+    for col in validation_report.columns:
+        value = summary_row_values[col]
+        if col.endswith('_Diff') and pd.notna(value) and isinstance(value, (int, float)):
+            measure_diffs[col[:-len('_Diff')]] = float(value)
+    counts = presence_counts(validation_report)
+    return {
+        'format_version': REPORT_METADATA_VERSION,
+        'report_sheet': report_sheet_name,
+        'avg_diff': sum(measure_diffs.values()) / len(measure_diffs) if measure_diffs else 0.0,
+        'presence_both': counts['both'],
+        'presence_excel_only': counts['excel_only'],
+        'presence_pbi_only': counts['pbi_only'],
+        'report_rows': len(validation_report) - 1,
+        'excel_keys': counts['both'] + counts['excel_only'],
+        'pbi_keys': counts['both'] + counts['pbi_only'],
+        'low_threshold': float(low_threshold),
+        'mid_threshold': float(mid_threshold),
+        'measure_diffs': measure_diffs,
+    }
+
+
+def report_metadata_rows(metadata):
+    rows = [('Key', 'Value')]
+    for key, value in metadata.items():
+        if key == 'measure_diffs':
+            rows.extend((f'measure_diff:{measure}', diff) for measure, diff in value.items())
+        else:
+            rows.append((key, value))
+    return rows
+
+
+def parse_report_metadata(rows):
+    """Inverse of report_metadata_rows; rows are the value tuples of the Report_Metadata sheet."""
+    metadata = {'measure_diffs': {}}
+    for row_num, row in enumerate(rows):
+        if row_num == 0 or not row or row[0] is None:
+            continue # Header / blank rows
+        key, value = row[0], row[1] if len(row) > 1 else None
+        if str(key).startswith('measure_diff:'):
+            metadata['measure_diffs'][str(key)[len('measure_diff:'):]] = value
+        else:
+            metadata[key] = value
+    return metadata
+
+
+def write_metadata_sheet(wb, metadata):
+    ws_metadata = wb.create_sheet(REPORT_METADATA_SHEET)
+    for row in report_metadata_rows(metadata):
+        ws_metadata.append(list(row))
+    ws_metadata.sheet_state = 'hidden' # HIDE THE SHEET
+
+
+# --- Top-K worst mismatches ---
+# A small index of the keys to look at first, built once with the report so triage (the page and
+# the hidden Top_Mismatches sheet) does not need to sort the whole report.
+TOP_MISMATCH_SHEET = "Top_Mismatches"
+TOP_MISMATCH_K = 20
+TOP_MISMATCH_COLUMNS = ['Category', 'Rank', 'unique_key', 'presence', 'Excel', 'PBI', 'Diff']
+
+
+def largest_positions(values, k):
+    """
+    Positions of the k largest values, largest first. Ties, including those at the k-th value, go to
+    the earlier position. The k-th value is found by an O(n) partition and only the k picks are sorted.
+    """
+    if len(values) > k:
+        kth_value = -np.partition(-values, k - 1)[k - 1]
+        above = np.flatnonzero(values > kth_value)
+        # argpartition picks arbitrarily among values equal to the k-th; keep the earliest instead
+        candidates = np.concatenate([above, np.flatnonzero(values == kth_value)[:k - len(above)]])
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+
+def top_mismatch_index(validation_report, k=TOP_MISMATCH_K):
+    """
+    For each measure, the k keys present on both sides with the largest non-zero _Diff, followed by
+    up to k keys found only in excel and up to k found only in PBI (in report order).
+    Columns are TOP_MISMATCH_COLUMNS; Excel / PBI / Diff are empty for the one-sided keys.
+    """
+    data_rows = validation_report.iloc[1:]
+    presence = data_rows['presence'].to_numpy()
+    both_positions = np.flatnonzero(presence == PRESENCE_LABELS['both'])
+    measures = [col[:-len('_Diff')] for col in data_rows.columns if col.endswith('_Diff')]
+    frames = []
+
+    for measure in measures:
+        diffs = pd.to_numeric(data_rows[f'{measure}_Diff'].iloc[both_positions], errors='coerce').fillna(0).to_numpy(dtype=float)
+        mismatched = both_positions[diffs > 0]
+        selected = data_rows.iloc[mismatched[largest_positions(diffs[diffs > 0], k)]]
+        frames.append(pd.DataFrame({
+            'Category': f'{measure}_Diff',
+            'Rank': np.arange(1, len(selected) + 1),
+            'unique_key': selected['unique_key'].to_numpy(),
+            'presence': selected['presence'].to_numpy(),
+            'Excel': selected[f'{measure}_excel'].to_numpy(),
+            'PBI': selected[f'{measure}_PBI'].to_numpy(),
+            'Diff': selected[f'{measure}_Diff'].to_numpy(),
+        }))
+
+    for label in (PRESENCE_LABELS['left_only'], PRESENCE_LABELS['right_only']):
+        selected = data_rows.iloc[np.flatnonzero(presence == label)[:k]]
+        frames.append(pd.DataFrame({
+            'Category': label,
+            'Rank': np.arange(1, len(selected) + 1),
+            'unique_key': selected['unique_key'].to_numpy(),
+            'presence': selected['presence'].to_numpy(),
+        }))
+    return pd.concat(frames, ignore_index=True).reindex(columns=TOP_MISMATCH_COLUMNS)
+
+
+def write_top_mismatches_sheet(wb, top_mismatches_df):
+    ws_top = wb.create_sheet(TOP_MISMATCH_SHEET)
+    ws_top.append(TOP_MISMATCH_COLUMNS)
+    for row in top_mismatches_df.itertuples(index=False, name=None):
+        ws_top.append([to_excel_value(value) for value in row])
+    ws_top.sheet_state = 'hidden' # HIDE THE SHEET
+
+
+def format_top_mismatches_for_display(top_mismatches_df):
+    display_df = top_mismatches_df.copy()
+    display_df['Diff'] = [f"{value * 100:.2f}%" if pd.notna(value) else '' for value in top_mismatches_df['Diff']]
+    return display_df
+
+
+# --- Report stages ---
+# val.run is split into memoized stages keyed by their actual inputs: compute_validation depends only
+# on the upload and the comparison options, so changing the colour thresholds only redoes the
+# xlsx formatting in render_report_workbook.
+# --- Incremental re-validation ---
+# Analysts usually fix and re-export only the PBI sheet. Aggregates are kept per sheet content
+# fingerprint, so re-validating recomputes only the side that changed plus the comparison.
+AGGREGATE_CACHE_MAX_ENTRIES = 8
+AGGREGATE_CACHE = OrderedDict()
+# Streamlit runs each session's script in its own thread; lookups and evictions must not interleave
+AGGREGATE_CACHE_LOCK = threading.Lock()
+
+
+def sheet_fingerprint(df):
+    """Content hash of a parsed sheet: column names, dtypes and every value, in row order."""
+    digest = hashlib.sha256()
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def aggregate_sheet_incremental(df_orig, dims, all_measures, normalise, compact_dtypes=False, recorder=None):
+    """
+    normalise + aggregate_side for one sheet, reusing the result of an earlier run on a sheet
+    with the same content (and the same dims, measures and normalisation).
+    Returns copies, since build_validation_report adds its key column to the aggregates.
+    Instrumented runs (recorder given) neither read nor fill the cache, so both stages are timed.
+    """
+    if recorder is None:
+        cache_key = (sheet_fingerprint(df_orig), tuple(dims), tuple(all_measures), compact_dtypes)
+        with AGGREGATE_CACHE_LOCK:
+            cached = AGGREGATE_CACHE.get(cache_key)
+            if cached is not None:
+                AGGREGATE_CACHE.move_to_end(cache_key)
+        if cached is not None:
+            return cached[0].copy(), dict(cached[1])
+
+    with stage(recorder, 'normalise', len(df_orig)):
+        df = normalise(df_orig)
+    with stage(recorder, 'aggregate', len(df)):
+        agg, totals = aggregate_side(df, dims, all_measures)
+    if recorder is not None:
+        return agg, totals
+
+    with AGGREGATE_CACHE_LOCK:
+        AGGREGATE_CACHE[cache_key] = (agg, totals)
+        while len(AGGREGATE_CACHE) > AGGREGATE_CACHE_MAX_ENTRIES:
+            AGGREGATE_CACHE.popitem(last=False)
+    return agg.copy(), dict(totals)
+
+
+def compute_validation(file_bytes, key_mode='string', use_streaming=False, compact_dtypes=False, recorder=None, max_workers=1):
+    # compact_dtypes normalises text per distinct value into categoricals (in-memory path only).
+    # max_workers > 1 aggregates and matches in hash partitions instead of the incremental cache.
+    # With a recorder the sheet and aggregate caches are bypassed, so every stage is timed
+    if use_streaming:
+        # Aggregate chunk by chunk; only the column names are needed for the checklist
+        validation_report, excel_agg, pbi_agg = generate_validation_report_chunked(
+            read_sheet_chunks(io.BytesIO(file_bytes), 'excel'),
+            read_sheet_chunks(io.BytesIO(file_bytes), 'PBI'),
+            key_mode=key_mode, recorder=recorder)
+        column_checklist_df = column_checklist(
+            pd.DataFrame(columns=read_sheet_columns(io.BytesIO(file_bytes), 'excel')),
+            pd.DataFrame(columns=read_sheet_columns(io.BytesIO(file_bytes), 'PBI')))
+    else:
+        cache_bytes = 0 if recorder is not None else None
+        with stage(recorder, 'read') as entry:
+            excel_df_orig = read_excel_cached(file_bytes, 'excel', max_bytes=cache_bytes)
+            pbi_df_orig = read_excel_cached(file_bytes, 'PBI', max_bytes=cache_bytes)
+            entry['rows'] = len(excel_df_orig) + len(pbi_df_orig)
+
+        # Normalising keeps dtypes (object stays object, compact text becomes categorical),
+        # so dims and measures can be detected on the sheets as read
+        dims, all_measures = detect_dims_and_measures(excel_df_orig, pbi_df_orig)
+        normalise = compact_text_columns if compact_dtypes else normalise_text_columns
+        if max_workers > 1:
+            with stage(recorder, 'normalise', len(excel_df_orig) + len(pbi_df_orig)):
+                excel_df = normalise(excel_df_orig)
+                pbi_df = normalise(pbi_df_orig)
+            validation_report, excel_agg, pbi_agg = generate_validation_report(excel_df, pbi_df, key_mode, recorder, max_workers)
+        else:
+            excel_agg, excel_totals = aggregate_sheet_incremental(excel_df_orig, dims, all_measures, normalise, compact_dtypes, recorder)
+            pbi_agg, pbi_totals = aggregate_sheet_incremental(pbi_df_orig, dims, all_measures, normalise, compact_dtypes, recorder)
+
+            with stage(recorder, 'key_matching', len(excel_agg) + len(pbi_agg)):
+                validation_report, excel_agg, pbi_agg = build_validation_report(excel_agg, pbi_agg, dims, all_measures, excel_totals, pbi_totals, key_mode=key_mode)
+        column_checklist_df = column_checklist(excel_df_orig, pbi_df_orig) # Use original for checklist case sensitivity if needed
+    with stage(recorder, 'diff_checker', len(validation_report) - 1):
+        diff_checker_df = generate_diff_checker(validation_report)
+    with stage(recorder, 'top_mismatches', len(validation_report) - 1):
+        top_mismatches_df = top_mismatch_index(validation_report)
+    return validation_report, column_checklist_df, diff_checker_df, top_mismatches_df
+
+
+# --- Quick (sampled) validation ---
+# A first look at a huge extract: only the keys whose normalised dimension tuple hashes into the
+# first QUICK_SAMPLE_RATE share of buckets are aggregated and matched. The hash depends only on
+# the key values, so both sides keep exactly the same keys and presence is estimated without bias.
+QUICK_SAMPLE_RATE = 0.05
+QUICK_HASH_BUCKETS = 10000
+
+
+def sampled_key_mask(df, dims, sample_rate):
+    """Boolean mask of the rows whose dimension tuple falls in the sampled hash buckets."""
+    if not dims:
+        return np.ones(len(df), dtype=bool)
+    # Numeric key columns are hashed as text so an int id on one side matches the same id read as text
+    keys = pd.DataFrame({dim: df[dim] if is_text_column(df[dim]) else df[dim].astype(str) for dim in dims})
+    hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+    return hashes % QUICK_HASH_BUCKETS < round(sample_rate * QUICK_HASH_BUCKETS)
+
+
+def proportion_interval(successes, n, z=1.96):
+    """(share, lower, upper) with the Wilson score interval; (0, 0, 1) when nothing was sampled."""
+    if n == 0:
+        return 0.0, 0.0, 1.0
+    share = successes / n
+    denominator = 1 + z ** 2 / n
+    centre = (share + z ** 2 / (2 * n)) / denominator
+    half_width = z * np.sqrt(share * (1 - share) / n + z ** 2 / (4 * n ** 2)) / denominator
+    return share, max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+def estimate_from_sample(sample_report, all_measures, sample_rate, mismatch_threshold, z=1.96):
+    """
+    Estimates for the full report from the report of the sampled keys: the number of keys, the
+    presence shares and, per measure, the share of keys whose _Diff exceeds mismatch_threshold,
+    each with a 95% interval. The per-measure total diffs of the summary row are exact.
+    """
+    data_rows = sample_report.iloc[1:]
+    n = len(data_rows)
+    rows = []
+
+    # Keys are kept independently with probability sample_rate, so the sampled count is binomial
+    key_spread = z * np.sqrt(n * (1 - sample_rate)) / sample_rate
+    rows.append({'Metric': 'Keys', 'Estimate': n / sample_rate, 'Lower': max(n, n / sample_rate - key_spread), 'Upper': n / sample_rate + key_spread, 'Unit': 'count'})
+
+    for presence_label, metric in (('Present in Both', 'Keys in both'), ('Present in excel', 'Keys only in excel'), ('Present in PBI', 'Keys only in PBI')):
+        share, lower, upper = proportion_interval(int(data_rows['presence'].eq(presence_label).sum()), n, z)
+        rows.append({'Metric': metric, 'Estimate': share, 'Lower': lower, 'Upper': upper, 'Unit': 'share'})
+
+    for measure in all_measures:
+        diffs = pd.to_numeric(data_rows[f'{measure}_Diff'], errors='coerce')
+        share, lower, upper = proportion_interval(int((diffs > mismatch_threshold).sum()), n, z)
+        rows.append({'Metric': f'{measure} keys with diff > {mismatch_threshold * 100:g}%', 'Estimate': share, 'Lower': lower, 'Upper': upper, 'Unit': 'share'})
+
+    for measure in all_measures:
+        total_diff = sample_report.iloc[0][f'{measure}_Diff']
+        rows.append({'Metric': f'{measure} total diff (exact)', 'Estimate': total_diff, 'Lower': total_diff, 'Upper': total_diff, 'Unit': 'share'})
+    return pd.DataFrame(rows)
+
+
+def format_estimates_for_display(estimates_df):
+    display_df = estimates_df.copy()
+    for col in ('Estimate', 'Lower', 'Upper'):
+        display_df[col] = [f"{value:,.0f}" if unit == 'count' else f"{value * 100:.2f}%"
+                           for value, unit in zip(estimates_df[col], estimates_df['Unit'])]
+    return display_df.drop(columns='Unit')
+
+
+def compute_quick_validation(file_bytes, key_mode='string', sample_rate=QUICK_SAMPLE_RATE, mismatch_threshold=0.05, recorder=None):
+    """
+    Validates only the hash-sampled keys. Returns (sample_report, estimates_df): the report of the
+    sampled keys, whose summary row carries the exact totals of both sheets, and the estimates of
+    estimate_from_sample. The sheets are still parsed in full, through the same cache as
+    compute_validation, so the exact run that follows does not parse them again.
+    """
+    cache_bytes = 0 if recorder is not None else None
+    with stage(recorder, 'quick_read') as entry:
+        excel_df_orig = read_excel_cached(file_bytes, 'excel', max_bytes=cache_bytes)
+        pbi_df_orig = read_excel_cached(file_bytes, 'PBI', max_bytes=cache_bytes)
+        entry['rows'] = len(excel_df_orig) + len(pbi_df_orig)
+
+    dims, all_measures = detect_dims_and_measures(excel_df_orig, pbi_df_orig)
+    sides = []
+    for df_orig in (excel_df_orig, pbi_df_orig):
+        with stage(recorder, 'quick_sample', len(df_orig)) as entry:
+            # Only the key and measure columns are needed; totals come from every row. Text is
+            # normalised once per distinct value, which gives the same keys as the row-wise path
+            df = compact_text_columns(df_orig[dims + all_measures])
+            fill_missing_dims(df, dims)
+            totals = {measure: df[measure].sum() for measure in all_measures}
+            df = df[sampled_key_mask(df, dims, sample_rate)]
+            entry['rows'] = len(df)
+        with stage(recorder, 'quick_aggregate', len(df)):
+            agg, _ = aggregate_side(df, dims, all_measures)
+        sides.append((agg, totals))
+
+    (excel_agg, excel_totals), (pbi_agg, pbi_totals) = sides
+    with stage(recorder, 'quick_key_matching', len(excel_agg) + len(pbi_agg)):
+        sample_report, _, _ = build_validation_report(excel_agg, pbi_agg, dims, all_measures, excel_totals, pbi_totals, key_mode=key_mode)
+    return sample_report, estimate_from_sample(sample_report, all_measures, sample_rate, mismatch_threshold)
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def compute_quick_validation_cached(file_bytes, key_mode='string', sample_rate=QUICK_SAMPLE_RATE, mismatch_threshold=0.05):
+    return compute_quick_validation(file_bytes, key_mode, sample_rate, mismatch_threshold)
+
+
+def format_report_for_display(validation_report):
+    display_report = validation_report.copy()
+    # Format _Diff columns for display
+    for col_name_display in display_report.columns:
+        if col_name_display.endswith('_Diff'):
+            # The first row (summary) _Diff is already a percentage (0-1), format it.
+            # Other rows _Diff are also percentages (0-1), format them too.
+            def format_diff_for_st_display(val):
+                if pd.notna(val) and isinstance(val, (int, float)):
+                    return f"{val * 100:.2f}%"
+                return val # if it's already text (like the summary unique_key) or NaN
+            display_report[col_name_display] = display_report[col_name_display].apply(format_diff_for_st_display)
+    return display_report
+
+
+# --- Paginated report preview ---
+# Only one page of the report is formatted and sent to the browser; filtering and sorting run on
+# the server over the numeric report.
+PREVIEW_PAGE_SIZES = [50, 100, 500]
+PREVIEW_SORT_REPORT_ORDER = "Report order"
+PREVIEW_SORT_MAX_DIFF = "Largest diff (any measure)"
+
+
+def max_abs_diff(data_rows):
+    """Largest |_Diff| of each data row across the measures (0 when there are no measures)."""
+    diff_columns = [col for col in data_rows.columns if col.endswith('_Diff')]
+    if not diff_columns:
+        return pd.Series(0.0, index=data_rows.index)
+    diffs = data_rows[diff_columns].apply(pd.to_numeric, errors='coerce').abs()
+    return diffs.max(axis=1).fillna(0.0)
+
+
+def select_preview_rows(validation_report, presence=None, min_diff=0.0, sort_by=PREVIEW_SORT_REPORT_ORDER, descending=True):
+    """
+    Data rows (without the summary row) of the report that pass the filters, sorted.
+    presence is a list of presence labels to keep (None keeps all); min_diff keeps rows whose
+    largest _Diff is at least that fraction; sort_by is a _Diff column, unique_key,
+    PREVIEW_SORT_MAX_DIFF or PREVIEW_SORT_REPORT_ORDER.
+    """
+    data_rows = validation_report.iloc[1:]
+    keep = np.ones(len(data_rows), dtype=bool)
+    if presence is not None:
+        keep &= data_rows['presence'].isin(presence).to_numpy()
+    row_max_diff = None
+    if min_diff > 0 or sort_by == PREVIEW_SORT_MAX_DIFF:
+        row_max_diff = max_abs_diff(data_rows)
+        if min_diff > 0:
+            keep &= (row_max_diff >= min_diff).to_numpy()
+    data_rows = data_rows[keep]
+
+    if sort_by == PREVIEW_SORT_REPORT_ORDER:
+        return data_rows
+    if sort_by == PREVIEW_SORT_MAX_DIFF:
+        sort_key = row_max_diff[keep]
+    elif sort_by.endswith('_Diff'):
+        sort_key = pd.to_numeric(data_rows[sort_by], errors='coerce')
+    else:
+        sort_key = data_rows[sort_by].astype(str)
+    # Stable, so ties keep the report order; missing values go last either way
+    order = sort_key.reset_index(drop=True).sort_values(ascending=not descending, kind='stable', na_position='last').index
+    return data_rows.iloc[order]
+
+
+def preview_page(validation_report, selected_rows, page, page_rows):
+    """Display frame of the summary row plus page `page` (1-based) of selected_rows."""
+    start = (page - 1) * page_rows
+    return format_report_for_display(pd.concat([validation_report.iloc[:1], selected_rows.iloc[start:start + page_rows]]))
+
+
+def show_report_preview(validation_report):
+    """Filter, sort and page controls over the report; only the visible page is rendered."""
+    diff_columns = [col for col in validation_report.columns if col.endswith('_Diff')]
+    filter_col, diff_col, sort_col, order_col = st.columns([3, 2, 3, 2])
+    presence = filter_col.multiselect("Presence", list(PRESENCE_LABELS.values()), default=list(PRESENCE_LABELS.values()), key="val_preview_presence")
+    min_diff_percent = diff_col.number_input("Min diff (%)", min_value=0.0, value=0.0, step=1.0, key="val_preview_min_diff", help="Show only keys where at least one measure differs by this much.")
+    sort_by = sort_col.selectbox("Sort by", [PREVIEW_SORT_REPORT_ORDER, PREVIEW_SORT_MAX_DIFF] + diff_columns + ['unique_key'], key="val_preview_sort_by")
+    descending = order_col.radio("Order", ["Descending", "Ascending"], horizontal=True, key="val_preview_order", disabled=sort_by == PREVIEW_SORT_REPORT_ORDER) == "Descending"
+
+    size_col, page_col, info_col = st.columns([2, 2, 6])
+    page_rows = size_col.selectbox("Rows per page", PREVIEW_PAGE_SIZES, index=1, key="val_preview_page_rows")
+    selected_rows = select_preview_rows(validation_report, presence, min_diff_percent / 100, sort_by, descending)
+    total_rows = len(selected_rows)
+    page_count = max(1, -(-total_rows // page_rows))
+    # The page lives only in session state: passing value= as well makes Streamlit warn
+    st.session_state.setdefault("val_preview_page", 1)
+    if st.session_state["val_preview_page"] > page_count:
+        # Narrower filters can leave the remembered page past the end
+        st.session_state["val_preview_page"] = page_count
+    page = page_col.number_input("Page", min_value=1, max_value=page_count, step=1, key="val_preview_page")
+    info_col.caption(f"{total_rows:,} of {len(validation_report) - 1:,} keys match the filters; page {page} of {page_count}. The summary row is always shown first.")
+
+    st.dataframe(preview_page(validation_report, selected_rows, page, page_rows), hide_index=True)
+
+
+# --- Native Excel conditional formatting ---
+# Instead of one fill per cell, the presence and _Diff colouring can be written as a few
+# worksheet-level rules over column ranges. Write time and file size then do not grow with
+# the number of cells, and the thresholds can be edited in Excel (Home > Conditional Formatting > Manage Rules).
+def add_diff_threshold_rules(ws, cell_range, top_left, low_thresh, mid_thresh, amber_gradient=False):
+    """
+    Green for diffs <= low_thresh, red above mid_thresh; the band in between is amber, or with
+    amber_gradient=True a yellow-to-dark-red colour scale (as the merger colours it).
+    Only numeric cells are coloured.
+    """
+    dark_green_fill = PatternFill(start_color='19D119', end_color='19D119', fill_type='solid')
+    dark_red_fill = PatternFill(start_color='E82D1C', end_color='E82D1C', fill_type='solid')
+    amber_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
+
+    ws.conditional_formatting.add(cell_range, FormulaRule(
+        formula=[f'AND(ISNUMBER({top_left}),{top_left}<={low_thresh})'], fill=dark_green_fill, stopIfTrue=True))
+    if amber_gradient:
+        ws.conditional_formatting.add(cell_range, FormulaRule(
+            formula=[f'AND(ISNUMBER({top_left}),{top_left}>{mid_thresh})'], fill=dark_red_fill, stopIfTrue=True))
+        if mid_thresh > low_thresh:
+            ws.conditional_formatting.add(cell_range, ColorScaleRule(
+                start_type='num', start_value=low_thresh, start_color='FFFF00',
+                end_type='num', end_value=mid_thresh, end_color='8B0000'))
+    else:
+        ws.conditional_formatting.add(cell_range, FormulaRule(
+            formula=[f'AND(ISNUMBER({top_left}),{top_left}<={mid_thresh})'], fill=amber_fill, stopIfTrue=True))
+        ws.conditional_formatting.add(cell_range, FormulaRule(
+            formula=[f'ISNUMBER({top_left})'], fill=dark_red_fill, stopIfTrue=True))
+
+
+def add_native_conditional_formatting(ws, report_columns, first_row, last_row, low_thresh, mid_thresh, amber_gradient=False):
+    if last_row < first_row:
+        return
+    dark_green_fill = PatternFill(start_color='19D119', end_color='19D119', fill_type='solid')
+    dark_red_fill = PatternFill(start_color='E82D1C', end_color='E82D1C', fill_type='solid')
+    for col_idx, col_name in enumerate(report_columns, 1):
+        column_letter = get_column_letter(col_idx)
+        cell_range = f'{column_letter}{first_row}:{column_letter}{last_row}'
+        top_left = f'{column_letter}{first_row}'
+        if str(col_name).endswith('_Diff'):
+            add_diff_threshold_rules(ws, cell_range, top_left, low_thresh, mid_thresh, amber_gradient)
+        elif col_name == 'presence':
+            ws.conditional_formatting.add(cell_range, FormulaRule(
+                formula=[f'{top_left}="Present in Both"'], fill=dark_green_fill, stopIfTrue=True))
+            ws.conditional_formatting.add(cell_range, FormulaRule(
+                formula=[f'OR({top_left}="Present in excel",{top_left}="Present in PBI")'], fill=dark_red_fill, stopIfTrue=True))
+
+
+def apply_conditional_formatting(ws, report_df, low_thresh, mid_thresh, native_rules=False):
+    # native_rules=True leaves the data-row fills to worksheet-level conditional-formatting rules
+    # --- Color definitions ---
+    dark_green_fill = PatternFill(start_color='19D119', end_color='19D119', fill_type='solid')
+    dark_red_fill = PatternFill(start_color='E82D1C', end_color='E82D1C', fill_type='solid')
+    amber_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
+
+    # Summary row fill (lighter blue)
+    summary_row_blue = '96DED1'
+    summary_fill = PatternFill(start_color=summary_row_blue, end_color=summary_row_blue, fill_type='solid')
+
+    # Header row fill (SLIGHTLY DARKER BLUE)
+    header_row_darker_blue = '6495ED' # Darker than 80BBD9
+    header_fill = PatternFill(start_color=header_row_darker_blue, end_color=header_row_darker_blue, fill_type='solid')
+
+    bold_font = Font(bold=True)
+
+    # --- Header Formatting (Row 1) ---
+    for cell in ws[1]:
+        cell.font = bold_font
+        cell.fill = header_fill # Use new darker blue for header
+
+    # --- Summary Row Formatting (Row 2 in Excel) ---
+    for col_idx, col_name in enumerate(report_df.columns, 1):
+        cell = ws.cell(row=2, column=col_idx)
+        cell.font = bold_font
+        cell.fill = summary_fill # Use lighter blue for summary row
+        if col_name.endswith('_Diff') and isinstance(report_df.iloc[0][col_name], (float, int)): # Check if value is numeric
+            cell.number_format = '0.00%'
+        # The 'unique_key' for summary is text: "Avg Diff: X.XX%"
+        # The 'presence' for summary is text: "Both: X, Excel: Y, PBI: Z"
+
+    # --- Data Rows Formatting (From Row 3 in Excel) ---
+    presence_col_letter = get_column_letter(report_df.columns.get_loc('presence') + 1)
+    for row_idx_df in range(1, len(report_df)): # DF index 1 is Excel row 3
+        excel_row_num = row_idx_df + 2
+        if not native_rules:
+            presence_cell_val = report_df.loc[row_idx_df, 'presence']
+            cell_to_format_presence = ws[f'{presence_col_letter}{excel_row_num}']
+            if presence_cell_val == 'Present in Both':
+                cell_to_format_presence.fill = dark_green_fill
+            elif presence_cell_val in ['Present in excel', 'Present in PBI']:
+                cell_to_format_presence.fill = dark_red_fill
+
+        for col_idx_data, col_name_data in enumerate(report_df.columns, 1):
+            if col_name_data.endswith('_Diff'):
+                value = report_df.loc[row_idx_df, col_name_data]
+                cell_to_format_diff = ws.cell(row=excel_row_num, column=col_idx_data)
+                if pd.notna(value) and isinstance(value, (float, int)):
+                    cell_to_format_diff.number_format = '0.00%'
+                    if native_rules: continue
+                    if value <= low_thresh: cell_to_format_diff.fill = dark_green_fill
+                    elif value <= mid_thresh: cell_to_format_diff.fill = amber_fill
+                    else: cell_to_format_diff.fill = dark_red_fill
+
+    if native_rules:
+        add_native_conditional_formatting(ws, report_df.columns, 3, len(report_df) + 1, low_thresh, mid_thresh)
+
+    for col_idx, column_name in enumerate(report_df.columns, 1):
+        column_letter = get_column_letter(col_idx)
+        max_length = len(str(column_name)) # Start with header length
+        for cell_val_series in report_df[column_name].astype(str):
+            if len(cell_val_series) > max_length: max_length = len(cell_val_series)
+        adjusted_width = (max_length + 2) if max_length > 0 else len(str(column_name)) + 5
+        ws.column_dimensions[column_letter].width = min(adjusted_width, 45)
+
+
+def write_report_workbook(validation_report, column_checklist_df, diff_checker_df, sheet_name_report, low_threshold, mid_threshold, native_rules=False, top_mismatches_df=None, metadata=None):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        validation_report.to_excel(writer, sheet_name=sheet_name_report, index=False)
+        ws_report = writer.sheets[sheet_name_report]
+        apply_conditional_formatting(ws_report, validation_report, low_threshold, mid_threshold, native_rules)
+
+        # Create Column_Checklist sheet
+        sheet_name_checklist = "Column_Checklist"[:31]
+        column_checklist_df.to_excel(writer, sheet_name=sheet_name_checklist, index=False)
+        ws_checklist = writer.sheets[sheet_name_checklist]
+        match_col_letter = get_column_letter(column_checklist_df.columns.get_loc('Match') + 1)
+        light_green_excel = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+        light_red_excel = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
+        for row_num in range(2, len(column_checklist_df) + 2):
+            cell = ws_checklist[f'{match_col_letter}{row_num}']
+            if cell.value == True: cell.fill = light_green_excel
+            elif cell.value == False: cell.fill = light_red_excel
+        for col_idx, column_name in enumerate(column_checklist_df.columns, 1):
+            column_letter = get_column_letter(col_idx)
+            max_col_len = max((column_checklist_df[column_name].astype(str).map(len).max(skipna=True)), len(str(column_name)))
+            if pd.isna(max_col_len): max_col_len = len(str(column_name))
+            ws_checklist.column_dimensions[column_letter].width = min(int(max_col_len) + 2, 40)
+        ws_checklist.sheet_state = 'hidden' # HIDE THE SHEET
+
+        # Create Diff_Checker_Summary sheet
+        sheet_name_diff_checker = "Diff_Checker_Summary"[:31]
+        diff_checker_df.to_excel(writer, sheet_name=sheet_name_diff_checker, index=False)
+        ws_diff_checker = writer.sheets[sheet_name_diff_checker]
+        for col_idx, column_name in enumerate(diff_checker_df.columns, 1):
+            column_letter = get_column_letter(col_idx)
+            max_col_len = max((diff_checker_df[column_name].astype(str).map(len).max(skipna=True)), len(str(column_name)))
+            if pd.isna(max_col_len): max_col_len = len(str(column_name))
+            ws_diff_checker.column_dimensions[column_letter].width = min(int(max_col_len) + 2, 50)
+        ws_diff_checker.sheet_state = 'hidden' # HIDE THE SHEET
+
+        write_top_mismatches_sheet(writer.book, top_mismatches_df if top_mismatches_df is not None else top_mismatch_index(validation_report))
+        write_metadata_sheet(writer.book, metadata if metadata is not None else build_report_metadata(validation_report, sheet_name_report, low_threshold, mid_threshold))
+    output.seek(0)
+    return output
+
+
+# --- Write-only streaming writer ---
+# Produces the same workbook as write_report_workbook in one forward pass over the rows: cells are
+# styled as they are emitted and flushed to the xlsx stream, so no cell object graph is kept in memory.
+HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+def to_excel_value(value):
+    if value is None or (not isinstance(value, str) and pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def styled_cell(ws, value, fill=None, font=None, number_format=None):
+    cell = WriteOnlyCell(ws, value=to_excel_value(value))
+    if fill is not None: cell.fill = fill
+    if font is not None: cell.font = font
+    if number_format is not None: cell.number_format = number_format
+    elif isinstance(cell.value, datetime.datetime): cell.number_format = 'YYYY-MM-DD HH:MM:SS'
+    elif isinstance(cell.value, datetime.date): cell.number_format = 'YYYY-MM-DD'
+    return cell
+
+
+def cell_with_style(ws, value, style_template):
+    # Reuses the style ids of a template cell; setting fill/number_format per cell re-hashes the styles
+    cell = WriteOnlyCell(ws, value=to_excel_value(value))
+    cell._style = copy.copy(style_template._style)
+    return cell
+
+
+def plain_value(ws, value):
+    # Dates still need a cell to carry the number format pandas would give them
+    if isinstance(value, (pd.Timestamp, datetime.date)):
+        return styled_cell(ws, value)
+    return to_excel_value(value)
+
+
+def header_cells(ws, columns, fill=None):
+    return [styled_cell(ws, col, fill=fill, font=Font(bold=True)) for col in columns]
+
+
+def style_header_cells(cells):
+    for cell in cells:
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+    return cells
+
+
+def max_text_lengths(df):
+    # Same measure as the openpyxl writer: longest str() of each column, header included
+    return {col: max(len(str(col)), int(df[col].astype(str).str.len().max()) if len(df) else 0) for col in df.columns}
+
+
+def write_report_workbook_streaming(validation_report, column_checklist_df, diff_checker_df, sheet_name_report, low_threshold, mid_threshold, native_rules=False, top_mismatches_df=None, metadata=None):
+    dark_green_fill = PatternFill(start_color='19D119', end_color='19D119', fill_type='solid')
+    dark_red_fill = PatternFill(start_color='E82D1C', end_color='E82D1C', fill_type='solid')
+    amber_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
+    summary_fill = PatternFill(start_color='96DED1', end_color='96DED1', fill_type='solid')
+    header_fill = PatternFill(start_color='6495ED', end_color='6495ED', fill_type='solid')
+    bold_font = Font(bold=True)
+
+    wb = Workbook(write_only=True)
+
+    # --- Validation report sheet ---
+    ws = wb.create_sheet(sheet_name_report)
+    columns = list(validation_report.columns)
+    # Widths must be set before the first row is written
+    for col_idx, (column_name, max_length) in enumerate(max_text_lengths(validation_report).items(), 1):
+        adjusted_width = (max_length + 2) if max_length > 0 else len(str(column_name)) + 5
+        ws.column_dimensions[get_column_letter(col_idx)].width = min(adjusted_width, 45)
+    ws.append(style_header_cells(header_cells(ws, columns, fill=header_fill)))
+
+    diff_positions = {pos for pos, col in enumerate(columns) if col.endswith('_Diff')}
+    presence_pos = columns.index('presence')
+    green_presence, red_presence = (styled_cell(ws, None, fill=fill) for fill in (dark_green_fill, dark_red_fill))
+    if native_rules:
+        # Data rows only carry the percent format; colouring comes from the sheet's rules
+        green_diff = amber_diff = red_diff = styled_cell(ws, None, number_format='0.00%')
+        add_native_conditional_formatting(ws, columns, 3, len(validation_report) + 1, low_threshold, mid_threshold)
+    else:
+        green_diff, amber_diff, red_diff = (styled_cell(ws, None, fill=fill, number_format='0.00%') for fill in (dark_green_fill, amber_fill, dark_red_fill))
+    for row_idx, row in enumerate(validation_report.itertuples(index=False, name=None)):
+        if row_idx == 0:
+            # Summary row
+            ws.append([styled_cell(ws, value, fill=summary_fill, font=bold_font,
+                                   number_format='0.00%' if pos in diff_positions and isinstance(value, (float, int)) else None)
+                       for pos, value in enumerate(row)])
+            continue
+        out_row = list(row)
+        for pos in diff_positions:
+            value = row[pos]
+            if pd.notna(value) and isinstance(value, (float, int)):
+                template = green_diff if value <= low_threshold else amber_diff if value <= mid_threshold else red_diff
+                out_row[pos] = cell_with_style(ws, value, template)
+        presence_value = row[presence_pos]
+        if not native_rules:
+            if presence_value == 'Present in Both':
+                out_row[presence_pos] = cell_with_style(ws, presence_value, green_presence)
+            elif presence_value in ['Present in excel', 'Present in PBI']:
+                out_row[presence_pos] = cell_with_style(ws, presence_value, red_presence)
+        ws.append([cell if isinstance(cell, Cell) else plain_value(ws, cell) for cell in out_row])
+
+    # --- Column_Checklist sheet (hidden) ---
+    ws_checklist = wb.create_sheet("Column_Checklist"[:31])
+    for col_idx, max_col_len in enumerate(max_text_lengths(column_checklist_df).values(), 1):
+        ws_checklist.column_dimensions[get_column_letter(col_idx)].width = min(int(max_col_len) + 2, 40)
+    ws_checklist.append(style_header_cells(header_cells(ws_checklist, column_checklist_df.columns)))
+    light_green_excel = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+    light_red_excel = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
+    match_pos = column_checklist_df.columns.get_loc('Match')
+    for row in column_checklist_df.itertuples(index=False, name=None):
+        out_row = [plain_value(ws_checklist, value) for value in row]
+        out_row[match_pos] = styled_cell(ws_checklist, row[match_pos], fill=light_green_excel if row[match_pos] == True else light_red_excel if row[match_pos] == False else None)
+        ws_checklist.append(out_row)
+    ws_checklist.sheet_state = 'hidden' # HIDE THE SHEET
+
+    # --- Diff_Checker_Summary sheet (hidden) ---
+    ws_diff_checker = wb.create_sheet("Diff_Checker_Summary"[:31])
+    for col_idx, max_col_len in enumerate(max_text_lengths(diff_checker_df).values(), 1):
+        ws_diff_checker.column_dimensions[get_column_letter(col_idx)].width = min(int(max_col_len) + 2, 50)
+    ws_diff_checker.append(style_header_cells(header_cells(ws_diff_checker, diff_checker_df.columns)))
+    for row in diff_checker_df.itertuples(index=False, name=None):
+        ws_diff_checker.append([plain_value(ws_diff_checker, value) for value in row])
+    ws_diff_checker.sheet_state = 'hidden' # HIDE THE SHEET
+
+    write_top_mismatches_sheet(wb, top_mismatches_df if top_mismatches_df is not None else top_mismatch_index(validation_report))
+    write_metadata_sheet(wb, metadata if metadata is not None else build_report_metadata(validation_report, sheet_name_report, low_threshold, mid_threshold))
+
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def compute_validation_cached(file_bytes, key_mode='string', use_streaming=False, compact_dtypes=False, max_workers=1):
+    return compute_validation(file_bytes, key_mode, use_streaming, compact_dtypes, max_workers=max_workers)
+
+
+# --- Exceptions-only reports ---
+# Healthy pages are mostly "Present in Both" keys within the amber threshold. In exceptions-only
+# mode those rows are left out of the report sheet and counted instead; the summary row, the
+# metadata, the checklist, the diff checker and the top mismatches still describe every key.
+def exceptions_only_report(validation_report, low_threshold, mid_threshold):
+    """
+    (summary row + the data rows that are one-sided or have a _Diff above mid_threshold,
+    counts of the suppressed rows: {'suppressed_rows', 'suppressed_green', 'suppressed_amber'}).
+    """
+    data_rows = validation_report.iloc[1:]
+    row_max_diff = max_abs_diff(data_rows).to_numpy()
+    keep = (data_rows['presence'] != PRESENCE_LABELS['both']).to_numpy() | (row_max_diff > mid_threshold)
+    suppressed_green = int((~keep & (row_max_diff <= low_threshold)).sum())
+    counts = {
+        'suppressed_rows': int((~keep).sum()),
+        'suppressed_green': suppressed_green,
+        'suppressed_amber': int((~keep).sum()) - suppressed_green,
+    }
+    return pd.concat([validation_report.iloc[:1], data_rows[keep]], ignore_index=True), counts
+
+
+def suppressed_rows_summary(counts, low_threshold, mid_threshold):
+    """Diff_Checker_Summary rows standing in for the rows left out of an exceptions-only report."""
+    return pd.DataFrame([
+        {'Diff Column Name': f'Suppressed rows: Present in Both, diff <= {low_threshold * 100:g}%', 'Percentage Difference': str(counts['suppressed_green'])},
+        {'Diff Column Name': f'Suppressed rows: Present in Both, {low_threshold * 100:g}% < diff <= {mid_threshold * 100:g}%', 'Percentage Difference': str(counts['suppressed_amber'])},
+    ])
+
+
+def build_report_workbook(validation_report, column_checklist_df, diff_checker_df, original_filename, low_threshold, mid_threshold, streaming_writer=False, native_rules=False, top_mismatches_df=None, exceptions_only=False):
+    """Returns the xlsx bytes and the metadata written to its metadata sheet."""
+    sheet_name_report = f"{original_filename}_validation_report"[:31]
+    writer = write_report_workbook_streaming if streaming_writer else write_report_workbook
+    # Metadata and top mismatches come from the full report, before rows are suppressed
+    metadata = build_report_metadata(validation_report, sheet_name_report, low_threshold, mid_threshold)
+    if exceptions_only:
+        if top_mismatches_df is None:
+            top_mismatches_df = top_mismatch_index(validation_report)
+        validation_report, counts = exceptions_only_report(validation_report, low_threshold, mid_threshold)
+        metadata.update(counts)
+        diff_checker_df = pd.concat([diff_checker_df, suppressed_rows_summary(counts, low_threshold, mid_threshold)], ignore_index=True)
+    output = writer(validation_report, column_checklist_df, diff_checker_df, sheet_name_report, low_threshold, mid_threshold, native_rules, top_mismatches_df, metadata)
+    return output.getvalue(), metadata
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def render_report_workbook(file_bytes, original_filename, key_mode, use_streaming, low_threshold, mid_threshold, streaming_writer=False, native_rules=False, compact_dtypes=False, max_workers=1, exceptions_only=False):
+    validation_report, column_checklist_df, diff_checker_df, top_mismatches_df = compute_validation_cached(file_bytes, key_mode, use_streaming, compact_dtypes, max_workers)
+    return build_report_workbook(validation_report, column_checklist_df, diff_checker_df, original_filename, low_threshold, mid_threshold, streaming_writer, native_rules, top_mismatches_df, exceptions_only)
+
+
 def run():
     st.markdown("""
         <style>
@@ -232,6 +1418,18 @@ def run():
     low_threshold = st.sidebar.number_input("Green Threshold (≤)", min_value=0.0, max_value=1.0, value=0.05, step=0.01)
     mid_threshold = st.sidebar.number_input("Amber Threshold (≤)", min_value=0.0, max_value=1.0, value=0.5, step=0.01)
 
+    st.sidebar.header("⚡ Performance Options")
+    use_key_codes = st.sidebar.checkbox("Integer-coded keys", value=False, help="Match rows on compact integer codes of the dimension values. Faster and uses less memory on wide, high-cardinality dimensions.")
+    use_streaming = st.sidebar.checkbox("Streaming ingestion (.xlsx)", value=False, help="Read both sheets in chunks and aggregate as they are read, so memory depends on the number of distinct keys rather than rows.")
+    streaming_writer = st.sidebar.checkbox("Streaming xlsx writer", value=False, help="Write the report in a single forward pass with constant memory. Recommended for very large reports.")
+    exceptions_only = st.sidebar.checkbox("Exceptions-only report", value=False, help="Write only one-sided keys and keys with a diff above the amber threshold. The rows left out are counted in the Diff_Checker_Summary and metadata sheets; the summary row still covers every key.")
+    native_rules = st.sidebar.checkbox("Native Excel conditional formatting", value=False, help="Colour presence and _Diff cells with a few Excel conditional-formatting rules instead of per-cell fills. Smaller files, and thresholds can be changed later in Excel.")
+    compact_dtypes = st.sidebar.checkbox("Compact dtypes", value=False, help="Hold text columns as categoricals normalised once per distinct value. Less memory and faster grouping on repetitive dimensions. Not used with streaming ingestion.")
+    max_workers = st.sidebar.number_input("Comparison processes", min_value=1, max_value=os.cpu_count() or 1, value=1, step=1, key="val_max_workers_sidebar", help="Aggregate and match hash partitions of the keys in parallel worker processes. Worth it for sheets with millions of rows. Not used with streaming ingestion.")
+    quick_estimate = st.sidebar.checkbox("Quick estimate first", value=False, help="Before the full report, validate a hash-selected sample of keys (the same keys on both sides) and show estimated presence and mismatch rates with 95% intervals. The full report follows on the same page.")
+    sample_percent = st.sidebar.slider("Sampled keys (%)", min_value=1, max_value=50, value=int(QUICK_SAMPLE_RATE * 100), disabled=not quick_estimate)
+    record_stages, trace_memory = instrumentation_options("val")
+
     st.markdown("""
     <div class="instructions">
     <h3 style="color: #4682B4;">How to Use:</h3>
@@ -250,136 +1448,51 @@ def run():
         st.markdown(f'<div class="file-list"><strong>Uploaded File:</strong> {uploaded_file.name}</div>', unsafe_allow_html=True)
         with st.spinner("Generating your validation report... Hang tight!"):
             try:
-                xls = pd.ExcelFile(uploaded_file)
-                excel_df_orig = pd.read_excel(xls, 'excel')
-                pbi_df_orig = pd.read_excel(xls, 'PBI')
-
-                excel_df = excel_df_orig.apply(lambda x: x.str.upper().str.strip() if x.dtype == "object" else x)
-                pbi_df = pbi_df_orig.apply(lambda x: x.str.upper().str.strip() if x.dtype == "object" else x)
-
-                validation_report, excel_agg, pbi_agg = generate_validation_report(excel_df.copy(), pbi_df.copy())
-                column_checklist_df = column_checklist(excel_df_orig, pbi_df_orig) # Use original for checklist case sensitivity if needed
-                diff_checker_df = generate_diff_checker(validation_report)
+                key_mode = 'codes' if use_key_codes else 'string'
+                file_bytes = uploaded_file.getvalue()
+                original_filename = os.path.splitext(uploaded_file.name)[0]
+                recorder = None
+                if record_stages:
+                    # Instrumented runs skip the result, sheet and aggregate caches so every stage is actually executed
+                    recorder = StageRecorder('val', trace_memory, context={'file': uploaded_file.name, 'key_mode': key_mode, 'streaming': use_streaming, 'streaming_writer': streaming_writer, 'native_rules': native_rules, 'compact_dtypes': compact_dtypes, 'quick_estimate': quick_estimate, 'max_workers': max_workers, 'exceptions_only': exceptions_only})
+
+                if quick_estimate:
+                    # Rendered before the exact report is computed, so the estimates show up first
+                    sample_rate = sample_percent / 100
+                    if recorder is not None:
+                        _, estimates_df = compute_quick_validation(file_bytes, key_mode, sample_rate, low_threshold, recorder=recorder)
+                    else:
+                        _, estimates_df = compute_quick_validation_cached(file_bytes, key_mode, sample_rate, low_threshold)
+                    st.subheader("Quick Estimate")
+                    st.caption(f"Estimated from {sample_percent}% of the keys; ranges are 95% intervals and mismatches are diffs above the green threshold. The exact report follows below.")
+                    st.dataframe(format_estimates_for_display(estimates_df), hide_index=True)
+
+                if recorder is not None:
+                    validation_report, column_checklist_df, diff_checker_df, top_mismatches_df = compute_validation(file_bytes, key_mode, use_streaming, compact_dtypes, recorder, max_workers)
+                else:
+                    validation_report, column_checklist_df, diff_checker_df, top_mismatches_df = compute_validation_cached(file_bytes, key_mode, use_streaming, compact_dtypes, max_workers)
 
                 st.subheader("Validation Report Preview")
-                display_report = validation_report.copy()
-                # Format _Diff columns for display
-                for col_name_display in display_report.columns:
-                    if col_name_display.endswith('_Diff'):
-                        # The first row (summary) _Diff is already a percentage (0-1), format it.
-                        # Other rows _Diff are also percentages (0-1), format them too.
-                        # The unique_key of summary is text, so it won't be affected.
-                        def format_diff_for_st_display(val):
-                            if pd.notna(val) and isinstance(val, (int, float)):
-                                return f"{val * 100:.2f}%"
-                            return val # if it's already text (like the summary unique_key) or NaN
-                        display_report[col_name_display] = display_report[col_name_display].apply(format_diff_for_st_display)
-                st.dataframe(display_report)
-
-
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    original_filename = os.path.splitext(uploaded_file.name)[0]
-                    sheet_name_report = f"{original_filename}_validation_report"[:31]
-                    validation_report.to_excel(writer, sheet_name=sheet_name_report, index=False)
-                    ws_report = writer.sheets[sheet_name_report]
-
-                    def apply_conditional_formatting(ws, report_df, low_thresh, mid_thresh):
-                        # --- Color definitions ---
-                        dark_green_fill = PatternFill(start_color='19D119', end_color='19D119', fill_type='solid')
-                        dark_red_fill = PatternFill(start_color='E82D1C', end_color='E82D1C', fill_type='solid')
-                        amber_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
-                        
-                        # Summary row fill (lighter blue)
-                        summary_row_blue = '96DED1'
-                        summary_fill = PatternFill(start_color=summary_row_blue, end_color=summary_row_blue, fill_type='solid')
-                        
-                        # Header row fill (SLIGHTLY DARKER BLUE)
-                        header_row_darker_blue = '6495ED' # Darker than 80BBD9
-                        header_fill = PatternFill(start_color=header_row_darker_blue, end_color=header_row_darker_blue, fill_type='solid')
-                        
-                        bold_font = Font(bold=True)
-
-                        # --- Header Formatting (Row 1) ---
-                        for cell in ws[1]:
-                            cell.font = bold_font
-                            cell.fill = header_fill # Use new darker blue for header
-
-                        # --- Summary Row Formatting (Row 2 in Excel) ---
-                        for col_idx, col_name in enumerate(report_df.columns, 1):
-                            cell = ws.cell(row=2, column=col_idx)
-                            cell.font = bold_font
-                            cell.fill = summary_fill # Use lighter blue for summary row
-                            if col_name.endswith('_Diff') and isinstance(report_df.iloc[0][col_name], (float, int)): # Check if value is numeric
-                                cell.number_format = '0.00%'
-                            # The 'unique_key' for summary is text: "Avg Diff: X.XX%"
-                            # The 'presence' for summary is text: "Both: X, Excel: Y, PBI: Z"
-
-                        # --- Data Rows Formatting (From Row 3 in Excel) ---
-                        presence_col_letter = get_column_letter(report_df.columns.get_loc('presence') + 1)
-                        for row_idx_df in range(1, len(report_df)): # DF index 1 is Excel row 3
-                            excel_row_num = row_idx_df + 2
-                            presence_cell_val = report_df.loc[row_idx_df, 'presence']
-                            cell_to_format_presence = ws[f'{presence_col_letter}{excel_row_num}']
-                            if presence_cell_val == 'Present in Both':
-                                cell_to_format_presence.fill = dark_green_fill
-                            elif presence_cell_val in ['Present in excel', 'Present in PBI']:
-                                cell_to_format_presence.fill = dark_red_fill
-
-                            for col_idx_data, col_name_data in enumerate(report_df.columns, 1):
-                                if col_name_data.endswith('_Diff'):
-                                    value = report_df.loc[row_idx_df, col_name_data]
-                                    cell_to_format_diff = ws.cell(row=excel_row_num, column=col_idx_data)
-                                    if pd.notna(value) and isinstance(value, (float, int)):
-                                        cell_to_format_diff.number_format = '0.00%'
-                                        if value <= low_thresh: cell_to_format_diff.fill = dark_green_fill
-                                        elif value <= mid_thresh: cell_to_format_diff.fill = amber_fill
-                                        else: cell_to_format_diff.fill = dark_red_fill
-                        
-                        for col_idx, column_name in enumerate(report_df.columns, 1):
-                            column_letter = get_column_letter(col_idx)
-                            max_length = len(str(column_name)) # Start with header length
-                            for cell_val_series in report_df[column_name].astype(str):
-                                if len(cell_val_series) > max_length: max_length = len(cell_val_series)
-                            adjusted_width = (max_length + 2) if max_length > 0 else len(str(column_name)) + 5
-                            ws.column_dimensions[column_letter].width = min(adjusted_width, 45)
-
-                    apply_conditional_formatting(ws_report, validation_report, low_threshold, mid_threshold)
-
-                    # Create Column_Checklist sheet
-                    sheet_name_checklist = "Column_Checklist"[:31]
-                    column_checklist_df.to_excel(writer, sheet_name=sheet_name_checklist, index=False)
-                    ws_checklist = writer.sheets[sheet_name_checklist]
-                    match_col_letter = get_column_letter(column_checklist_df.columns.get_loc('Match') + 1)
-                    light_green_excel = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
-                    light_red_excel = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-                    for row_num in range(2, len(column_checklist_df) + 2):
-                        cell = ws_checklist[f'{match_col_letter}{row_num}']
-                        if cell.value == True: cell.fill = light_green_excel
-                        elif cell.value == False: cell.fill = light_red_excel
-                    for col_idx, column_name in enumerate(column_checklist_df.columns, 1):
-                        column_letter = get_column_letter(col_idx)
-                        max_col_len = max((column_checklist_df[column_name].astype(str).map(len).max(skipna=True)), len(str(column_name)))
-                        if pd.isna(max_col_len): max_col_len = len(str(column_name))
-                        ws_checklist.column_dimensions[column_letter].width = min(int(max_col_len) + 2, 40)
-                    ws_checklist.sheet_state = 'hidden' # HIDE THE SHEET
-
-                    # Create Diff_Checker_Summary sheet
-                    sheet_name_diff_checker = "Diff_Checker_Summary"[:31]
-                    diff_checker_df.to_excel(writer, sheet_name=sheet_name_diff_checker, index=False)
-                    ws_diff_checker = writer.sheets[sheet_name_diff_checker]
-                    for col_idx, column_name in enumerate(diff_checker_df.columns, 1):
-                        column_letter = get_column_letter(col_idx)
-                        max_col_len = max((diff_checker_df[column_name].astype(str).map(len).max(skipna=True)), len(str(column_name)))
-                        if pd.isna(max_col_len): max_col_len = len(str(column_name))
-                        ws_diff_checker.column_dimensions[column_letter].width = min(int(max_col_len) + 2, 50)
-                    ws_diff_checker.sheet_state = 'hidden' # HIDE THE SHEET
-
-
-                output.seek(0)
+                show_report_preview(validation_report)
+
+                st.subheader("Worst Mismatches")
+                st.caption(f"The {TOP_MISMATCH_K} keys with the largest diff for each measure, then the first {TOP_MISMATCH_K} keys found on one side only. Also saved in the hidden {TOP_MISMATCH_SHEET} sheet.")
+                if top_mismatches_df.empty:
+                    st.info("No mismatched or one-sided keys.")
+                else:
+                    top_categories = list(dict.fromkeys(top_mismatches_df['Category']))
+                    top_category = st.selectbox("Category", top_categories, key="val_top_category")
+                    st.dataframe(format_top_mismatches_for_display(top_mismatches_df[top_mismatches_df['Category'] == top_category]), hide_index=True)
+
+                if recorder is not None:
+                    with stage(recorder, 'report_write', len(validation_report)):
+                        output, _ = build_report_workbook(validation_report, column_checklist_df, diff_checker_df, original_filename, low_threshold, mid_threshold, streaming_writer, native_rules, top_mismatches_df, exceptions_only)
+                else:
+                    output, _ = render_report_workbook(file_bytes, original_filename, key_mode, use_streaming, low_threshold, mid_threshold, streaming_writer, native_rules, compact_dtypes, max_workers, exceptions_only)
                 new_file_name = f"{original_filename}_validation_report.xlsx"
                 st.markdown(f'<div class="success-box">Success! Your validation report is ready: <strong>{new_file_name}</strong></div>', unsafe_allow_html=True)
                 st.download_button("Download Your Validation Report!", output, new_file_name, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                show_stage_timings(recorder, original_filename)
 
             except Exception as e:
                 st.error(f"An error occurred during report generation: {e}")